@@ -0,0 +1,147 @@
+"""Measure fix_file on synthetic corpora and catch performance regressions.
+
+Three scenarios are run, each on its own corpus from corpus.py:
+- clean: modules using the new syntax already, which need no fix
+- dirty: modules where a share of the blocks need a fix
+- pathological: modules with deeply nested and very wide annotations
+
+For each, the best time over the repeats gives the files/s and lines/s, and
+a separate pass under tracemalloc gives the peak memory. The results can be
+saved as JSON and compared with a previous run:
+
+    python benchmarks/bench_fix_file.py --json before.json
+    python benchmarks/bench_fix_file.py --baseline before.json --tolerance 0.1
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from corpus import EXCLUDE_LINES, generate_module, generate_pathological, write_corpus
+
+from fix_future_annotations import fix_file, fix_source
+from fix_future_annotations._config import Config
+
+
+def _fix_all(paths: list[Path], config: Config) -> int:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return sum(fix_file(path, config=config) for path in paths)
+
+
+def run_scenario(sources: list[str], config: Config, repeat: int) -> dict[str, Any]:
+    lines = sum(source.count("\n") for source in sources)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = write_corpus(Path(tmpdir), sources)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            changed = _fix_all(paths, config)
+            best = min(best, time.perf_counter() - start)
+        tracemalloc.start()
+        _fix_all(paths, config)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    # What the corpus exercises, to make sure that it covers every rewrite
+    edits: Counter[str] = Counter()
+    for source in sources:
+        edits.update(fix_source(source, config=config).edits)
+    return {
+        "files": len(sources),
+        "lines": lines,
+        "changed": changed,
+        "seconds": best,
+        "files_per_s": len(sources) / best,
+        "lines_per_s": lines / best,
+        "peak_kib": peak / 1024,
+        "edits": dict(sorted(edits.items())),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--blocks", type=int, default=40, help="Blocks per module")
+    parser.add_argument(
+        "--density", type=float, default=0.3, help="Share of dirty blocks"
+    )
+    parser.add_argument("--depth", type=int, default=60, help="Pathological nesting")
+    parser.add_argument("--width", type=int, default=300, help="Pathological union")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Save the results to this file")
+    parser.add_argument(
+        "--baseline", type=Path, help="Compare with the results saved in this file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="The slowdown relative to the baseline that fails the run",
+    )
+    args = parser.parse_args()
+
+    config = Config(exclude_lines=EXCLUDE_LINES)
+    pathological_files = max(1, args.files // 20)
+    scenarios = {
+        "clean": [
+            generate_module(n, blocks=args.blocks, density=0, seed=args.seed)
+            for n in range(args.files)
+        ],
+        "dirty": [
+            generate_module(n, blocks=args.blocks, density=args.density, seed=args.seed)
+            for n in range(args.files)
+        ],
+        "pathological": [
+            generate_pathological(n, depth=args.depth, width=args.width)
+            for n in range(pathological_files)
+        ],
+    }
+    results = {
+        name: run_scenario(sources, config, args.repeat)
+        for name, sources in scenarios.items()
+    }
+
+    print(
+        f"{'scenario':<14}{'files':>7}{'changed':>9}{'files/s':>11}"
+        f"{'lines/s':>12}{'peak KiB':>11}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<14}{result['files']:>7}{result['changed']:>9}"
+            f"{result['files_per_s']:>11.0f}{result['lines_per_s']:>12.0f}"
+            f"{result['peak_kib']:>11.0f}"
+        )
+    print(
+        "edits:", dict(sum((Counter(r["edits"]) for r in results.values()), Counter()))
+    )
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        regressed = False
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            ratio = result["seconds"] / baseline[name]["seconds"]
+            status = "REGRESSION" if ratio > 1 + args.tolerance else "ok"
+            regressed |= status != "ok"
+            print(f"{name}: {ratio:.2f}x the baseline time, {status}")
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
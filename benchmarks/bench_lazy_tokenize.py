@@ -0,0 +1,117 @@
+"""Measure what lazy tokenization saves on a mostly clean corpus.
+
+Files are only tokenized when the visitor finds something to rewrite. Both
+pipelines, parsing, visiting and rewriting every source of the same corpus,
+are timed: the lazy one skips the tokenizer when there is nothing to rewrite,
+the eager one always runs it. The best time over the repeats is reported.
+
+    python benchmarks/bench_lazy_tokenize.py --files 2000 --dirty-ratio 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import time
+from typing import Callable
+
+from tokenize_rt import src_to_tokens
+
+from fix_future_annotations._config import Config
+from fix_future_annotations._utils import Brackets, Edit, apply_edits
+from fix_future_annotations._visitor import AnnotationVisitor
+
+CLEAN_MODULE = """\
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+class Model{n}:
+    name: str
+    tags: list[str]
+
+    def __init__(self, name: str, tags: Iterable[str] = ()) -> None:
+        self.name = name
+        self.tags = list(tags)
+
+    def get(self, key: str, default: int | None = None) -> dict[str, int]:
+        return {{key: default or 0}}
+"""
+
+DIRTY_MODULE = """\
+from typing import Dict, List, Optional
+
+
+class Model{n}:
+    name: str
+    tags: List[str]
+
+    def get(self, key: str, default: Optional[int] = None) -> Dict[str, int]:
+        return {{key: default or 0}}
+"""
+
+
+def _fix(source: str, config: Config, *, eager: bool) -> str:
+    tree = ast.parse(source)
+    visitor = AnnotationVisitor(source.splitlines(), config=config)
+    token_funcs = visitor.get_token_functions(tree)
+    if not eager and not token_funcs:
+        return source
+    tokens = src_to_tokens(source)
+    brackets = Brackets(tokens)
+    edits: list[Edit] = []
+    for i, token in enumerate(tokens):
+        if token.src:
+            for func in token_funcs.get(token.offset, []):
+                edits.extend(func(i, tokens, brackets))
+    return apply_edits(tokens, edits)
+
+
+def _best_time(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--dirty-ratio", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dirty_every = round(1 / args.dirty_ratio) if args.dirty_ratio else 0
+    config = Config()
+    sources = [
+        (DIRTY_MODULE if dirty_every and n % dirty_every == 0 else CLEAN_MODULE)
+        .format(n=n)
+        for n in range(args.files)
+    ]
+    results = [_fix(source, config, eager=False) for source in sources]
+    clean = sum(result == source for result, source in zip(results, sources))
+    # Both pipelines must give the same results for the comparison to hold
+    assert results == [_fix(source, config, eager=True) for source in sources]
+
+    lazy = _best_time(
+        lambda: [_fix(source, config, eager=False) for source in sources],
+        args.repeat,
+    )
+    eager = _best_time(
+        lambda: [_fix(source, config, eager=True) for source in sources],
+        args.repeat,
+    )
+    print(f"files: {args.files}, clean: {clean}")
+    print(f"lazy tokenization:  {lazy:.3f}s ({args.files / lazy:.0f} files/s)")
+    print(f"eager tokenization: {eager:.3f}s ({args.files / eager:.0f} files/s)")
+    print(f"speedup: {eager / lazy:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
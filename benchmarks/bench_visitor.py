@@ -0,0 +1,55 @@
+"""Measure the per-node cost of the AnnotationVisitor traversal on a large file.
+
+python benchmarks/bench_visitor.py --functions 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import time
+
+from fix_future_annotations._config import Config
+from fix_future_annotations._visitor import AnnotationVisitor
+
+HEADER = """\
+import typing as t
+from typing import Dict, List, Optional, Union
+"""
+
+FUNCTION = '''
+def func_{n}(
+    a: Optional[int], b: Union[str, bytes] = b"", *args: List[int], **kwargs: t.Any
+) -> Dict[str, List[Optional["Model"]]]:
+    """Docstring of func_{n}"""
+    result = {{"a": a, "b": [b, b.upper()], "args": list(args)}}
+    for key, value in kwargs.items():
+        if isinstance(value, (int, float)) and value > {n}:
+            result[key] = [value * 2, value ** 2, -value]
+    return result
+'''
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--functions", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    source = HEADER + "".join(FUNCTION.format(n=n) for n in range(args.functions))
+    lines = source.splitlines()
+    tree = ast.parse(source)
+    nodes = sum(1 for _ in ast.walk(tree))
+    config = Config(exclude_lines=["# ffa: ignore"])
+
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        AnnotationVisitor(lines, config=config).get_token_functions(tree)
+        best = min(best, time.perf_counter() - start)
+    print(f"lines: {len(lines)}, nodes: {nodes}")
+    print(f"visit: {best:.3f}s, {best / nodes * 1e9:.0f}ns per node")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compare the scandir walker with the os.walk() based one on a synthetic tree.
+
+The tree mimics a checkout with vendored environments: most of the files are
+in a virtualenv, node_modules and a build directory, plus a directory that is
+ignored by .gitignore and one excluded by exclude_files.
+
+    python benchmarks/bench_walker.py --files 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+from fix_future_annotations._config import Config
+from fix_future_annotations._walk import walk_python_files
+
+# (directory, share of the files)
+LAYOUT = [
+    ("src/app", 0.15),
+    (".venv/lib/python3.11/site-packages", 0.45),
+    ("node_modules", 0.15),
+    ("build/lib", 0.1),
+    ("generated", 0.1),
+    ("vendor", 0.05),
+]
+FILES_PER_DIR = 50
+
+
+def walk_files(top: str, config: Config) -> Iterator[str]:
+    # The walker used before
+    for root, _, files in os.walk(top):
+        for filename in files:
+            if filename.endswith(".py"):
+                fn = os.path.join(root, filename).replace("\\", "/")
+                if not config.is_file_excluded(fn):
+                    yield fn
+
+
+def make_tree(top: Path, files: int) -> None:
+    for directory, share in LAYOUT:
+        count = int(files * share)
+        for n in range(count):
+            subdir = top / directory / f"pkg{n // FILES_PER_DIR}"
+            if n % FILES_PER_DIR == 0:
+                subdir.mkdir(parents=True)
+            suffix = ".py" if n % 4 else ".pyi"
+            (subdir / f"module{n}{suffix}").touch()
+    (top / ".gitignore").write_text("/generated/\n*.pyc\n")
+
+
+def measure(func: Callable[[], Iterator[str]], repeat: int) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in func())
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    config = Config(exclude_files=["^.*/vendor/"])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_tree(Path(tmpdir), args.files)
+        old, old_count = measure(lambda: walk_files(tmpdir, config), args.repeat)
+        new, new_count = measure(
+            lambda: walk_python_files(tmpdir, config=config), args.repeat
+        )
+
+    print(f"files in tree: {args.files}")
+    print(f"os.walk: {old:.3f}s, {old_count} files")
+    print(f"scandir: {new:.3f}s, {new_count} files")
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""Generate synthetic modules for the benchmarks.
+
+A module is a header followed by blocks of code. The dirty blocks cover the
+patterns of tests/samples: Optional, Union, the typing collection aliases
+(imported by name, through a module alias and under another name), Literal,
+string annotations, excluded blocks and the typing imports that become
+unused. The clean blocks use the new syntax already.
+
+    python benchmarks/corpus.py --files 100 --blocks 50 --density 0.3 corpus/
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+from pathlib import Path
+
+# The exclude_lines to use with the corpus
+EXCLUDE_LINES = ["# ffa: ignore", "class NoFix"]
+
+DIRTY_HEADER = '''\
+"""Module {n}"""
+import typing as t
+from typing import Dict, FrozenSet, List, Literal, Optional, Set, Tuple, Type, Union
+from typing import Tuple as MyTuple
+'''
+
+CLEAN_HEADER = '''\
+"""Module {n}"""
+from __future__ import annotations
+
+from collections.abc import Iterable
+'''
+
+DIRTY_BLOCKS = [
+    # Optional
+    """
+def optional_{n}(a: Optional[int] = None, b: Optional["Model"] = None) -> Optional[str]:
+    return None if a is None else str(a)
+""",
+    # Union, with a multi-line subscript
+    """
+def union_{n}(value: Union[int, str, None]) -> Union[
+    int, str
+]:
+    return value or {n}
+""",
+    # Collection aliases
+    """
+class Collections{n}:
+    items: List[int]
+    mapping: Dict[str, Set[int]]
+    frozen: FrozenSet[str]
+    kind: Type[Exception]
+
+    def pair(self) -> Tuple[str, int]:
+        return "pair", {n}
+""",
+    # The typing module through an alias, and a name imported as another
+    """
+def aliases_{n}(x: t.Optional[t.List[int]]) -> MyTuple[str, t.Dict[str, int]]:
+    y: t.Union[int, str] = {n}
+    return str(y), {{}}
+""",
+    # Literal, whose strings are not annotations
+    """
+def literal_{n}(mode: Literal["r", "w"] = "r") -> "Model":
+    return Model(mode)
+""",
+    # String annotations
+    """
+def strings_{n}(parent: "Model", children: "List[Model]") -> "Optional[Model]":
+    return parent if children else None
+""",
+    # Excluded blocks
+    """
+class NoFix{n}:
+    def __init__(self, names: List[str]) -> None:
+        self.names = names
+
+
+def ignored_{n}() -> Union[str, int]:  # ffa: ignore
+    return {n}
+""",
+    # Nested subscripts
+    """
+def nested_{n}(data: Dict[str, List[Optional[Tuple[int, ...]]]]) -> None:
+    for key, values in data.items():
+        print(key, len(values))
+""",
+]
+
+CLEAN_BLOCKS = [
+    """
+def clean_{n}(items: Iterable[int], default: int | None = None) -> list[int]:
+    result = [item * 2 for item in items if item]
+    return result or [default or {n}]
+""",
+    """
+class Clean{n}:
+    names: dict[str, tuple[int, ...]]
+
+    def __init__(self, names: dict[str, tuple[int, ...]] | None = None) -> None:
+        self.names = names or {{}}
+
+    def get(self, key: str) -> tuple[int, ...] | None:
+        return self.names.get(key)
+""",
+    """
+def compute_{n}(x: int, y: int = {n}) -> float:
+    total = 0
+    for i in range(x):
+        if i % 3 == 0 and y > 0:
+            total += i * y
+    return total / (x or 1)
+""",
+]
+
+MODEL = """
+
+class Model:
+    def __init__(self, name: str = "") -> None:
+        self.name = name
+"""
+
+
+def generate_module(n: int, *, blocks: int, density: float, seed: int = 0) -> str:
+    """Return the source of a module of ``blocks`` blocks, of which about
+    ``density`` are dirty.
+    """
+    rng = random.Random(seed * 1_000_003 + n)
+    dirty = density > 0
+    parts = [(DIRTY_HEADER if dirty else CLEAN_HEADER).format(n=n)]
+    for i in range(blocks):
+        if dirty and rng.random() < density:
+            # Go through the patterns in turn so that all of them show up
+            template = DIRTY_BLOCKS[(n + i) % len(DIRTY_BLOCKS)]
+        else:
+            template = rng.choice(CLEAN_BLOCKS)
+        parts.append("\n" + template.format(n=i))
+    if dirty:
+        parts.append(MODEL)
+    return "".join(parts)
+
+
+def generate_pathological(n: int, *, depth: int, width: int) -> str:
+    """Return the source of a module with deeply nested and very wide
+    annotations.
+    """
+    nested = "int"
+    for i in range(depth):
+        nested = ("Optional[{}]", "List[{}]", "Dict[str, {}]")[i % 3].format(nested)
+    union = ", ".join(f"Type{i}" for i in range(width))
+    classes = "".join(f"class Type{i}: ...\n" for i in range(width))
+    return f'''\
+"""Pathological module {n}"""
+from typing import Dict, List, Optional, Union
+
+{classes}
+
+def nested_{n}(value: {nested}) -> None:
+    pass
+
+
+def wide_{n}(value: Union[{union}]) -> Optional[Union[{union}]]:
+    return value
+'''
+
+
+def write_corpus(directory: Path, sources: list[str]) -> list[Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for n, source in enumerate(sources):
+        path = directory / f"module_{n}.py"
+        path.write_text(source)
+        paths.append(path)
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--blocks", type=int, default=50)
+    parser.add_argument("--density", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sources = [
+        generate_module(n, blocks=args.blocks, density=args.density, seed=args.seed)
+        for n in range(args.files)
+    ]
+    write_corpus(args.directory, sources)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,48 @@
-from fix_future_annotations._main import fix_file
+# Not imported from typing, which is slow to import for the entry point
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from fix_future_annotations._incremental import FixSession
+    from fix_future_annotations._main import (
+        FixResult,
+        check_source,
+        fix_file,
+        fix_source,
+        fix_sources,
+    )
+    from fix_future_annotations._stats import Stats
 
 
-__all__ = ["fix_file"]
+__all__ = [
+    "FixResult",
+    "FixSession",
+    "Stats",
+    "check_source",
+    "fix_file",
+    "fix_source",
+    "fix_sources",
+]
+
+# The modules defining the names, imported on first access so that the
+# command line entry point, in fix_future_annotations._client, can talk to
+# the daemon without importing them.
+_MODULES = {
+    "FixResult": "_main",
+    "FixSession": "_incremental",
+    "Stats": "_stats",
+    "check_source": "_main",
+    "fix_file": "_main",
+    "fix_source": "_main",
+    "fix_sources": "_main",
+}
+
+
+def __getattr__(name: str) -> object:
+    try:
+        module = _MODULES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
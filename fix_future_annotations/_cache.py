@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING
+
+from fix_future_annotations._config import Config
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+DEFAULT_CACHE_DIR = ".fix_future_annotations_cache"
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+@functools.lru_cache(maxsize=None)
+def _tool_version() -> str:
+    # The hash of the package sources, so that any change of the code busts
+    # the cache, even in a source checkout. This is much cheaper than
+    # importing importlib.metadata to read the installed version.
+    digest = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(package_dir, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class Cache:
+    """An on-disk cache of the files that are known to need no fix.
+
+    Each entry is an empty file named after the hash of the file content,
+    salted with the tool version and the effective configuration. Looking up
+    a file therefore costs one hash and one stat.
+
+    The entries are spread over 256 buckets by the first byte of the hash,
+    each of which keeps at most 1/256 of ``max_entries``, so that a run only
+    has to look at the buckets it wrote to.
+
+    The configuration given here is the default one for the lookups, the
+    files with another configuration pass it to the methods.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        path: str | Path = DEFAULT_CACHE_DIR,
+        *,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.path = os.fspath(path)
+        self.max_entries = max_entries
+        self.config = config
+        # The salts of the configurations, by id
+        self._salts: dict[int, tuple[Config, bytes]] = {}
+        # The buckets written to since the cache was created
+        self.written: set[str] = set()
+
+    def _salt(self, config: Config | None) -> bytes:
+        if config is None:
+            config = self.config
+        try:
+            return self._salts[id(config)][1]
+        except KeyError:
+            pass
+        key = json.dumps([_tool_version(), config.to_dict()], sort_keys=True)
+        salt = hashlib.sha256(key.encode("utf-8")).digest()
+        # Keep a reference to the config so that its id can't be reused
+        self._salts[id(config)] = (config, salt)
+        return salt
+
+    def __getstate__(self) -> dict[str, object]:
+        # The ids are only valid in this process
+        return {**self.__dict__, "_salts": {}}
+
+    def _entry(self, content: str, config: Config | None) -> str:
+        salt = self._salt(config)
+        digest = hashlib.sha256(salt + content.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def is_clean(self, content: str, config: Config | None = None) -> bool:
+        """Return whether the content is known to need no fix."""
+        entry = self._entry(content, config)
+        try:
+            # Refresh the mtime so that eviction drops the least recently used.
+            os.utime(entry)
+        except OSError:
+            # Missing, or in a cache that can't be written to, e.g. a read-only
+            # checkout: the refresh is only best effort.
+            return os.path.exists(entry)
+        return True
+
+    def mark_clean(self, content: str, config: Config | None = None) -> None:
+        """Remember that the content needs no fix."""
+        entry = self._entry(content, config)
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path, exist_ok=True)
+                # Keep the cache out of version control
+                with open(os.path.join(self.path, ".gitignore"), "w") as f:
+                    f.write("*\n")
+            bucket = os.path.dirname(entry)
+            os.makedirs(bucket, exist_ok=True)
+            with open(entry, "a"):
+                pass
+        except OSError:
+            return
+        self.written.add(os.path.basename(bucket))
+
+    def prune(self) -> None:
+        """Evict the least recently used entries of the buckets written to,
+        beyond their share of ``max_entries``.
+        """
+        max_bucket_entries = -(-self.max_entries // 256)
+        for name in sorted(self.written):
+            bucket = os.path.join(self.path, name)
+            try:
+                names = os.listdir(bucket)
+            except OSError:
+                continue
+            if len(names) <= max_bucket_entries:
+                continue
+            entries: list[tuple[int, str]] = []
+            for entry in names:
+                path = os.path.join(bucket, entry)
+                try:
+                    entries.append((os.stat(path).st_mtime_ns, path))
+                except OSError:
+                    pass
+            entries.sort()
+            for _, path in entries[: len(entries) - max_bucket_entries]:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        self.written.clear()
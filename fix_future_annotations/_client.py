@@ -0,0 +1,130 @@
+"""The entry point of the command line, and the client of the daemon.
+
+With ``--use-daemon``, the arguments(and stdin) are sent to the daemon serving
+the current directory before anything else is imported: the client only
+needs a socket. Otherwise, or if no daemon is running, the command runs in
+this process.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import sys
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any
+
+
+def get_socket_path(cwd: str | None = None) -> str | None:
+    """Return the path of the socket of the daemon serving the directory, or
+    None if the platform doesn't support the daemon.
+    """
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"):
+        return None
+    import hashlib
+
+    cwd = os.path.abspath(cwd or os.getcwd())
+    digest = hashlib.sha256(cwd.encode("utf-8")).hexdigest()[:16]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        # A directory of the user in the shared temporary directory, which is
+        # created by the daemon with no access for the others. The names are
+        # short, the path of a socket is limited to about 100 bytes.
+        runtime_dir = os.path.join(_temp_dir(), f"ffa-{os.getuid()}")
+    return os.path.join(runtime_dir, f"ffa-{digest}.sock")
+
+
+def _temp_dir() -> str:
+    # The same lookup as tempfile.gettempdir(), which is slower to import
+    for name in ("TMPDIR", "TEMP", "TMP"):
+        path = os.environ.get(name)
+        if path:
+            return path
+    return "/tmp"
+
+
+def _is_trusted(path: str) -> bool:
+    """Return whether the socket belongs to the current user, in a directory
+    where nobody else may replace it.
+    """
+    try:
+        st = os.stat(path)
+        dir_st = os.stat(os.path.dirname(path))
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and not dir_st.st_mode & 0o022
+
+
+def send(sock: socket.socket, message: dict[str, Any]) -> None:
+    import json
+
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def receive(sock: socket.socket) -> dict[str, Any] | None:
+    import json
+
+    with sock.makefile("rb") as f:
+        line = f.readline()
+    return json.loads(line) if line else None
+
+
+def connect(path: str | None) -> socket.socket | None:
+    """Connect to the socket if it is trusted, or return None."""
+    if path is None or not _is_trusted(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def run_client(argv: list[str], *, stdin: bool = False) -> int | None:
+    """Run the command in the daemon serving the current directory and return
+    the exit code, or None if no daemon is running.
+    """
+    sock = connect(get_socket_path())
+    if sock is None:
+        return None
+    with sock:
+        request: dict[str, Any] = {"command": "run", "argv": argv}
+        if stdin:
+            data = sys.stdin.buffer.read()
+            request["stdin"] = data.decode("utf-8", "surrogateescape")
+        send(sock, request)
+        response = receive(sock)
+    if response is None:
+        if not stdin:
+            return None
+        print("The daemon exited unexpectedly", file=sys.stderr)
+        return 1
+    for stream, key in ((sys.stdout, "stdout"), (sys.stderr, "stderr")):
+        stream.flush()
+        stream.buffer.write(response[key].encode("utf-8", "surrogateescape"))
+        stream.flush()
+    return response["code"]
+
+
+def _reads_stdin(argv: list[str]) -> bool:
+    # Either "-" as the path or --files-from -, which is all that argparse
+    # would tell here.
+    return "-" in argv or "--files-from=-" in argv
+
+
+def main(argv: list[str] | None = None) -> None:
+    if argv is None:
+        argv = sys.argv[1:]
+    if "--use-daemon" in argv and argv[:1] != ["daemon"] and "--watch" not in argv:
+        code = run_client(argv, stdin=_reads_stdin(argv))
+        if code is not None:
+            if code:
+                sys.exit(code)
+            return
+    from fix_future_annotations._main import main as run_main
+
+    run_main(argv, use_daemon=False)
@@ -1,38 +1,282 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from pathlib import Path
+from functools import cached_property
+import os
 import re
 import sys
+from typing import TYPE_CHECKING, Any, Optional, Tuple
 
-if sys.version_info >= (3, 11):
-    import tomllib
-else:
-    import tomli as tomllib
+if TYPE_CHECKING:
+    from pathlib import Path
+
+CONFIG_FILE = "pyproject.toml"
 
 
-@dataclass
 class Config:
     """Configuration for fix_future_annotations."""
 
-    # The line patterns(regex) to exclude from the fix.
-    exclude_lines: list[str] = field(default_factory=list)
-    # The file patterns(regex) to exclude from the fix.
-    exclude_files: list[str] = field(default_factory=list)
+    # Not a dataclass, importing dataclasses(and inspect with it) is a good
+    # part of the startup time.
+    _fields = ("exclude_lines", "exclude_files")
+
+    def __init__(
+        self,
+        exclude_lines: list[str] | None = None,
+        exclude_files: list[str] | None = None,
+    ) -> None:
+        # The line patterns(regex) to exclude from the fix.
+        self.exclude_lines: list[str] = [] if exclude_lines is None else exclude_lines
+        # The file patterns(regex) to exclude from the fix.
+        self.exclude_files: list[str] = [] if exclude_files is None else exclude_files
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({args})"
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def to_dict(self) -> dict[str, list[str]]:
+        return {name: getattr(self, name) for name in self._fields}
 
     @classmethod
     def from_file(cls, path: str | Path = "pyproject.toml") -> Config:
         """Load the configuration from a file."""
         try:
-            with open(path, "rb") as f:
-                data = tomllib.load(f)
+            table = _read_table(path)
         except OSError:
             return cls()
         else:
-            return cls(**data.get("tool", {}).get("fix_future_annotations", {}))
+            return cls(**(table or {}))
+
+    @cached_property
+    def _file_pattern(self) -> re.Pattern[str] | _PatternList | None:
+        return _compile_patterns(self.exclude_files)
+
+    @cached_property
+    def _line_pattern(self) -> re.Pattern[str] | _PatternList | None:
+        return _compile_patterns(self.exclude_lines)
+
+    @cached_property
+    def _multiline_line_pattern(self) -> re.Pattern[str] | _PatternList | None:
+        return _compile_patterns(self.exclude_lines, re.MULTILINE)
 
     def is_file_excluded(self, file_path: str) -> bool:
-        return any(re.search(pattern, file_path) for pattern in self.exclude_files)
+        return self._file_pattern is not None and bool(
+            self._file_pattern.search(file_path)
+        )
+
+    @cached_property
+    def _dir_pattern(self) -> re.Pattern[str] | _PatternList | None:
+        # A match of these in the path of a directory is also a match in the
+        # paths below it, since they don't look past the end of the match.
+        return _compile_patterns(
+            [p for p in self.exclude_files if not _LOOKAHEAD_RE.search(p)]
+        )
+
+    def is_dir_excluded(self, dir_path: str) -> bool:
+        """Return whether all the files under the directory are excluded."""
+        return self._dir_pattern is not None and bool(
+            self._dir_pattern.search(dir_path + "/")
+        )
 
     def is_line_excluded(self, line: str) -> bool:
-        return any(re.search(pattern, line) for pattern in self.exclude_lines)
+        return self._line_pattern is not None and bool(self._line_pattern.search(line))
+
+    def get_excluded_lines(self, lines: list[str]) -> set[int]:
+        """Return the numbers(1-based) of the lines that are excluded."""
+        pattern = self._line_pattern
+        if pattern is None:
+            return set()
+        if any(anchor in p for p in self.exclude_lines for anchor in ("\\A", "\\Z")):
+            # Those anchors mean the start and end of each line, which can't be
+            # told apart from the start and end of the whole text.
+            return {
+                lineno for lineno, line in enumerate(lines, 1) if pattern.search(line)
+            }
+        # Search the whole text at once, and confirm each match against its
+        # line since a pattern may match across lines.
+        text = "\n".join(lines)
+        search = self._multiline_line_pattern.search
+        excluded: set[int] = set()
+        lineno = 1
+        line_start = 0
+        while True:
+            match = search(text, line_start)
+            if match is None:
+                return excluded
+            lineno += text.count("\n", line_start, match.start())
+            if pattern.search(lines[lineno - 1]):
+                excluded.add(lineno)
+            line_start = text.find("\n", match.start()) + 1
+            if not line_start:
+                return excluded
+            lineno += 1
+
+
+def _read_table(path: str | Path) -> dict[str, Any] | None:
+    """Return the table of the tool in the file, or None if there is none."""
+    with open(path, "rb") as f:
+        # Only import the parser when there is a file to parse
+        if sys.version_info >= (3, 11):
+            import tomllib
+        else:
+            import tomli as tomllib
+
+        data = tomllib.load(f)
+    return data.get("tool", {}).get("fix_future_annotations")
+
+
+Stamp = Optional[Tuple[int, int]]
+
+
+def _stamp(path: str) -> Stamp:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ConfigResolver:
+    """Find the configuration of each file.
+
+    A file uses the configuration of the nearest pyproject.toml with a
+    ``[tool.fix_future_annotations]`` table, in its directory or the parents
+    of it, or the default configuration if there is none. The configurations
+    are loaded once and shared by all the directories they apply to.
+
+    If ``config_file`` is given, its configuration applies to all the files.
+    """
+
+    def __init__(self, config_file: str | None = None) -> None:
+        self.config_file = config_file
+        # The (mtime, size) of the files looked at, None if missing
+        self._stamps: dict[str, Stamp] = {}
+        self._override: Config | None = None
+        if config_file is not None:
+            self._stamps[config_file] = _stamp(config_file)
+            self._override = Config.from_file(config_file)
+        self._default = Config()
+        # The configuration of the directories, by path as given(which is
+        # cheaper to look up) and by absolute path.
+        self._by_dir: dict[str, Config] = {}
+        self._by_abs_dir: dict[str, Config] = {}
+
+    def for_path(self, path: str | Path) -> Config:
+        """Return the configuration of the file."""
+        return self.for_dir(os.path.dirname(path))
+
+    def for_dir(self, directory: str | Path) -> Config:
+        """Return the configuration of the files in the directory."""
+        directory = os.fspath(directory)
+        try:
+            return self._by_dir[directory]
+        except KeyError:
+            pass
+        if self._override is not None:
+            config = self._override
+        else:
+            config = self._resolve(os.path.abspath(directory))
+        self._by_dir[directory] = config
+        return config
+
+    def _resolve(self, directory: str) -> Config:
+        pending: list[str] = []
+        while True:
+            config = self._by_abs_dir.get(directory)
+            if config is not None:
+                break
+            pending.append(directory)
+            config = self._load(directory)
+            if config is not None:
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                config = self._default
+                break
+            directory = parent
+        for directory in pending:
+            self._by_abs_dir[directory] = config
+        return config
+
+    def _load(self, directory: str) -> Config | None:
+        path = os.path.join(directory, CONFIG_FILE)
+        self._stamps[path] = _stamp(path)
+        if self._stamps[path] is None:
+            return None
+        try:
+            table = _read_table(path)
+        except OSError:
+            return None
+        except ValueError as e:  # TOMLDecodeError
+            # A broken file, possibly of another project, must not stop the run
+            print(f"Ignoring {path}: {e}", file=sys.stderr)
+            return None
+        if table is None:
+            return None
+        unknown = sorted(set(table) - set(Config._fields))
+        if unknown:
+            print(
+                f"Ignoring {path}: unknown keys in [tool.fix_future_annotations]: "
+                + ", ".join(unknown),
+                file=sys.stderr,
+            )
+            return None
+        return Config(**table)
+
+    def is_file_excluded(self, file_path: str) -> bool:
+        return self.for_path(file_path).is_file_excluded(file_path)
+
+    def is_stale(self) -> bool:
+        """Return whether any of the files looked at has changed since."""
+        return any(_stamp(path) != stamp for path, stamp in self._stamps.items())
+
+
+_GLOBAL_FLAGS_RE = re.compile(r"\(\?([aiLmsux]+)\)")
+# What may depend on the text after the match: end anchors, word boundaries
+# and lookaheads
+_LOOKAHEAD_RE = re.compile(r"\$|\\[ZbB]|\(\?[=!]")
+
+
+class _PatternList:
+    """Patterns searched one by one, for those that can't be combined."""
+
+    def __init__(self, patterns: list[re.Pattern[str]]) -> None:
+        self.patterns = patterns
+
+    def search(self, string: str, pos: int = 0) -> re.Match[str] | None:
+        """Return the match starting first among the patterns."""
+        first = None
+        for pattern in self.patterns:
+            match = pattern.search(string, pos)
+            if match is not None and (first is None or match.start() < first.start()):
+                first = match
+        return first
+
+
+def _compile_patterns(
+    patterns: list[str], flags: int = 0
+) -> re.Pattern[str] | _PatternList | None:
+    """Compile the patterns into one alternation, or into a list if any of
+    them has groups: the group numbers and names would clash once combined.
+    """
+    if not patterns:
+        return None
+    compiled = [re.compile(pattern, flags) for pattern in patterns]
+    if any(pattern.groups for pattern in compiled):
+        return _PatternList(compiled)
+    parts = []
+    for pattern in patterns:
+        match = _GLOBAL_FLAGS_RE.match(pattern)
+        if match:
+            # Global flags are only allowed at the start of the expression,
+            # turn them into scoped flags.
+            parts.append(f"(?{match.group(1)}:{pattern[match.end():]})")
+        else:
+            parts.append(f"(?:{pattern})")
+    return re.compile("|".join(parts), flags)
@@ -0,0 +1,152 @@
+"""A daemon serving the command line over a Unix socket.
+
+Starting the interpreter, importing the modules and loading the configuration
+make up most of the time of a run on a few files. The daemon pays for those
+once and keeps the configurations, with their compiled patterns, in memory.
+They are reloaded when any pyproject.toml looked at changes.
+
+There is one daemon per working directory, and the clients started with
+``--use-daemon`` in that directory send their arguments(and stdin) to it
+through fix_future_annotations._client.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from typing import Any
+
+from fix_future_annotations._client import connect, get_socket_path, receive, send
+from fix_future_annotations._config import ConfigResolver
+from fix_future_annotations._main import _parse_args, _run
+
+
+def _request(path: str, message: dict[str, Any]) -> dict[str, Any] | None:
+    sock = connect(path)
+    if sock is None:
+        return None
+    with sock:
+        send(sock, message)
+        return receive(sock)
+
+
+class _Daemon:
+    def __init__(self) -> None:
+        # By the --config option
+        self._resolvers: dict[str | None, ConfigResolver] = {}
+
+    def get_resolver(self, config_file: str | None) -> ConfigResolver:
+        resolver = self._resolvers.get(config_file)
+        if resolver is None or resolver.is_stale():
+            resolver = self._resolvers[config_file] = ConfigResolver(config_file)
+        return resolver
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        stdin_data = request.get("stdin", "").encode("utf-8", "surrogateescape")
+        stdin = io.TextIOWrapper(io.BytesIO(stdin_data), encoding="utf-8")
+        stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        stderr = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        saved = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+        try:
+            args = _parse_args(request["argv"])
+            code = _run(args, self.get_resolver(args.config))
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved
+        stdout.flush()
+        stderr.flush()
+        return {
+            "code": code,
+            "stdout": stdout.buffer.getvalue().decode("utf-8", "surrogateescape"),
+            "stderr": stderr.buffer.getvalue().decode("utf-8", "surrogateescape"),
+        }
+
+
+def _exit(signum: int, frame: Any) -> None:
+    sys.exit(0)
+
+
+def serve_forever(argv: list[str] | None = None) -> int:
+    """Run the daemon for the current directory until it is stopped."""
+    parser = argparse.ArgumentParser(
+        prog="fix-future-annotations daemon",
+        description="Serve the clients started with --use-daemon in the "
+        "current directory",
+    )
+    parser.add_argument(
+        "--stop", action="store_true", help="Stop the daemon that is running"
+    )
+    args = parser.parse_args(argv)
+    path = get_socket_path()
+    if path is None:
+        print("The daemon is not supported on this platform", file=sys.stderr)
+        return 1
+    if args.stop:
+        if _request(path, {"command": "stop"}) is None:
+            print("No daemon is running", file=sys.stderr)
+            return 1
+        return 0
+    if _request(path, {"command": "ping"}) is not None:
+        print("A daemon is already running at", path, file=sys.stderr)
+        return 1
+    runtime_dir = os.path.dirname(path)
+    os.makedirs(runtime_dir, mode=0o700, exist_ok=True)
+    dir_st = os.stat(runtime_dir)
+    if dir_st.st_uid != os.getuid() or dir_st.st_mode & 0o022:
+        print(
+            f"Refusing to serve in {runtime_dir}: it must belong to the current "
+            "user and not be writable by the others",
+            file=sys.stderr,
+        )
+        return 1
+    if os.path.exists(path):  # left by a daemon that didn't exit cleanly
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only the current user may connect
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    except OSError as e:  # e.g. a path too long for a socket
+        server.close()
+        print(f"Failed to serve on {path}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        os.umask(umask)
+    server.listen()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _exit)
+    print("Serving on", path, flush=True)
+    daemon = _Daemon()
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                request = receive(conn)
+                if request is None:
+                    continue
+                command = request.get("command")
+                if command == "stop":
+                    send(conn, {"code": 0})
+                    break
+                elif command == "ping":
+                    send(conn, {"code": 0})
+                else:
+                    send(conn, daemon.handle(request))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+    return 0
@@ -0,0 +1,173 @@
+"""Unified diffs between the original and the fixed file content.
+
+The fixes only touch a few lines here and there, so instead of running
+difflib's matcher over both files, the lines are first aligned on the lines
+that occur exactly once in each of them(as patience diff does), and difflib
+only looks at the small gaps left between those anchors.
+"""
+
+from __future__ import annotations
+
+import difflib
+from bisect import bisect_left
+from collections import Counter
+from typing import Iterator, List, Tuple
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def _anchors(
+    a: list[str], b: list[str], alo: int, ahi: int, blo: int, bhi: int
+) -> list[tuple[int, int]]:
+    """Return the longest increasing run of the pairs of lines that are unique
+    in both ranges.
+    """
+    a_counts = Counter(a[alo:ahi])
+    b_counts = Counter(b[blo:bhi])
+    b_index = {
+        line: j
+        for j, line in enumerate(b[blo:bhi], blo)
+        if b_counts[line] == 1 and a_counts[line] == 1
+    }
+    pairs = [
+        (i, b_index[line]) for i, line in enumerate(a[alo:ahi], alo) if line in b_index
+    ]
+    # Longest increasing subsequence of the b positions, by patience sorting
+    tails: list[int] = []
+    tail_pairs: list[int] = []
+    previous: list[int] = []
+    for n, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_pairs.append(n)
+        else:
+            tails[pos] = j
+            tail_pairs[pos] = n
+        previous.append(tail_pairs[pos - 1] if pos else -1)
+    result: list[tuple[int, int]] = []
+    n = tail_pairs[-1] if tail_pairs else -1
+    while n >= 0:
+        result.append(pairs[n])
+        n = previous[n]
+    result.reverse()
+    return result
+
+
+def _affixes(
+    a: list[str], b: list[str], alo: int, ahi: int, blo: int, bhi: int
+) -> tuple[int, int]:
+    """Return the lengths of the common prefix and suffix of the ranges."""
+    prefix = 0
+    while (
+        alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]
+    ):
+        prefix += 1
+    suffix = 0
+    while (
+        alo + prefix < ahi - suffix
+        and blo + prefix < bhi - suffix
+        and a[ahi - suffix - 1] == b[bhi - suffix - 1]
+    ):
+        suffix += 1
+    return prefix, suffix
+
+
+def get_opcodes(a: list[str], b: list[str]) -> list[Opcode]:
+    """Like ``difflib.SequenceMatcher(None, a, b).get_opcodes()``"""
+    opcodes: list[Opcode] = []
+
+    def add(tag: str, i1: int, i2: int, j1: int, j2: int) -> None:
+        if i1 == i2 and j1 == j2:
+            return
+        if opcodes and tag == "equal" and opcodes[-1][0] == "equal":
+            _, i1, _, j1, _ = opcodes.pop()
+        opcodes.append((tag, i1, i2, j1, j2))
+
+    def diff_range(alo: int, ahi: int, blo: int, bhi: int, anchored: bool) -> None:
+        prefix, suffix = _affixes(a, b, alo, ahi, blo, bhi)
+        add("equal", alo, alo + prefix, blo, blo + prefix)
+        alo += prefix
+        blo += prefix
+        ahi -= suffix
+        bhi -= suffix
+        if anchored:
+            for i, j in _anchors(a, b, alo, ahi, blo, bhi):
+                diff_range(alo, i, blo, j, False)
+                add("equal", i, i + 1, j, j + 1)
+                alo, blo = i + 1, j + 1
+            diff_range(alo, ahi, blo, bhi, False)
+        elif alo < ahi or blo < bhi:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                add(tag, i1 + alo, i2 + alo, j1 + blo, j2 + blo)
+        add("equal", ahi, ahi + suffix, bhi, bhi + suffix)
+
+    diff_range(0, len(a), 0, len(b), True)
+    return opcodes
+
+
+def _group_opcodes(codes: list[Opcode], n: int) -> Iterator[list[Opcode]]:
+    # Same as difflib.SequenceMatcher.get_grouped_opcodes()
+    if not codes:
+        codes = [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    nn = n + n
+    group: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _format_range(start: int, stop: int) -> str:
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def unified_diff(
+    a: list[str],
+    b: list[str],
+    fromfile: str = "",
+    tofile: str = "",
+    n: int = 3,
+    lineterm: str = "\n",
+) -> Iterator[str]:
+    """Like ``difflib.unified_diff()``, without the file dates."""
+    started = False
+    for group in _group_opcodes(get_opcodes(a, b), n):
+        if not started:
+            started = True
+            yield f"--- {fromfile}{lineterm}"
+            yield f"+++ {tofile}{lineterm}"
+        first, last = group[0], group[-1]
+        file1_range = _format_range(first[1], last[2])
+        file2_range = _format_range(first[3], last[4])
+        yield f"@@ -{file1_range} +{file2_range} @@{lineterm}"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in a[i1:i2]:
+                    yield " " + line
+                continue
+            if tag in {"replace", "delete"}:
+                for line in a[i1:i2]:
+                    yield "-" + line
+            if tag in {"replace", "insert"}:
+                for line in b[j1:j2]:
+                    yield "+" + line
@@ -0,0 +1,65 @@
+"""Ask git for the files that changed, so that only those get checked."""
+
+from __future__ import annotations
+
+import os
+import subprocess
+from typing import Iterable
+
+# Added, copied, modified or renamed: the files that exist after the change
+_DIFF_FILTER = "--diff-filter=ACMR"
+
+
+def _git(*args: str) -> list[str] | None:
+    """Run a git command and return the NUL separated items of its output, or
+    None if it fails.
+    """
+    try:
+        proc = subprocess.run(["git", *args], capture_output=True, check=False)
+    except OSError:  # git is not installed
+        return None
+    if proc.returncode != 0:
+        return None
+    return [item for item in proc.stdout.decode("utf-8").split("\0") if item]
+
+
+def get_changed_files(
+    *, since: str | None = None, staged: bool = False
+) -> list[str] | None:
+    """Return the paths, relative to the current directory, of the files that
+    changed since the ref or that are staged.
+
+    The files changed since the ref include the uncommitted and untracked ones,
+    and are diffed against the merge base of the ref and HEAD, so that the
+    changes made on the ref after the branching point are left out.
+    Return None if the current directory is not in a git repository or the
+    ref is unknown.
+    """
+    # The paths are listed from the root of the repository, since with
+    # --relative or from a subdirectory git leaves out the files outside of it
+    toplevel = _git("rev-parse", "--show-toplevel")
+    if toplevel is None:
+        return None
+    root = toplevel[0].rstrip("\n")
+    if staged:
+        files = _git("-C", root, "diff", "--cached", "--name-only", "-z", _DIFF_FILTER)
+        return None if files is None else _relative_to_cwd(root, files)
+    assert since is not None
+    merge_base = _git("merge-base", since, "HEAD")
+    if merge_base is None:
+        return None
+    changed = _git(
+        "-C", root, "diff", "--name-only", "-z", _DIFF_FILTER, merge_base[0].strip()
+    )
+    untracked = _git("-C", root, "ls-files", "--others", "--exclude-standard", "-z")
+    if changed is None or untracked is None:
+        return None
+    return sorted(_relative_to_cwd(root, {*changed, *untracked}))
+
+
+def _relative_to_cwd(root: str, files: Iterable[str]) -> list[str]:
+    # "/" separated like the paths from git and the walker
+    return [
+        os.path.relpath(os.path.join(root, name)).replace(os.sep, "/")
+        for name in files
+    ]
@@ -0,0 +1,191 @@
+"""Fix a source again and again as it is edited, for editor integrations.
+
+A session keeps the top-level statements of the previous source, with what
+the visitor found in each of them. Given a new source, the lines that are the
+same at the start and at the end are kept, and only the lines in between are
+parsed again, from the end of the last statement kept before them to the start
+of the first one kept after them. A statement is visited again only if it is
+new, or if the imports before it tell something else than when it was visited.
+The rest(the unused typing imports, the future import) is decided for the whole
+module from what was found in all the statements, like a full run does.
+
+The whole source is parsed again when the lines in between can't be parsed
+on their own, or if a ``from __future__`` import is among or after them, since
+whether it is valid depends on what comes before it.
+"""
+
+from __future__ import annotations
+
+import ast
+import re
+from bisect import bisect_left
+
+from fix_future_annotations._config import Config
+from fix_future_annotations._main import FixResult, _rewrite
+from fix_future_annotations._prescan import might_need_fix
+from fix_future_annotations._stats import Stats, timing
+from fix_future_annotations._visitor import AnnotationVisitor, ImportState
+
+# The lines as numbered by the parser, which doesn't break them at the other
+# characters str.splitlines() does(e.g. form feeds).
+_LINE_RE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+\Z")
+
+
+class _Statement:
+    """One or more top-level statements, more than one when they share a line."""
+
+    __slots__ = ("nodes", "base", "start", "end", "has_future", "key", "visitor")
+
+    def __init__(self, node: ast.stmt, start: int, base: int) -> None:
+        self.nodes = [node]
+        # The number of the first line in the numbering of the nodes, and its
+        # number in the current source
+        self.base = start - base
+        self.start = start
+        self.end = node.end_lineno + base
+        self.has_future = _is_future_import(node)
+        # What the visit depends on, and the visitor that found what to fix
+        self.key: tuple[ImportState, frozenset[int]] | None = None
+        self.visitor: AnnotationVisitor | None = None
+
+    def add(self, node: ast.stmt, base: int) -> None:
+        self.nodes.append(node)
+        self.end = max(self.end, node.end_lineno + base)
+        self.has_future = self.has_future or _is_future_import(node)
+
+    def move(self, line_delta: int) -> None:
+        self.start += line_delta
+        self.end += line_delta
+
+
+def _is_future_import(node: ast.stmt) -> bool:
+    return isinstance(node, ast.ImportFrom) and node.module == "__future__"
+
+
+def _split_statements(body: list[ast.stmt], base: int = 0) -> list[_Statement]:
+    """Group the statements of a module parsed from the lines after ``base``"""
+    statements: list[_Statement] = []
+    for node in body:
+        start = node.lineno
+        for decorator in getattr(node, "decorator_list", ()):
+            start = min(start, decorator.lineno)
+        start += base
+        if statements and statements[-1].end >= start:
+            statements[-1].add(node, base)
+        else:
+            statements.append(_Statement(node, start, base))
+    return statements
+
+
+class FixSession:
+    """Fix successive versions of a source, e.g. on each save in an editor.
+
+    ``fix()`` returns the same result as ``fix_source()`` would, but only
+    analyzes again the top-level statements whose text changed since the
+    previous call.
+    """
+
+    def __init__(self, *, config: Config | None = None) -> None:
+        if config is None:
+            config = Config()
+        self.config = config
+        self._lines: list[str] | None = None
+        self._statements: list[_Statement] = []
+
+    def fix(self, source: str, *, stats: Stats | None = None) -> FixResult:
+        """Fix the new version of the source like fix_source() does."""
+        with timing(stats, "prescan"):
+            need_fix = might_need_fix(source)
+        if stats is not None:
+            stats.counts["sources"] += 1
+            stats.counts["skipped"] += not need_fix
+        if not need_fix:
+            self._lines = None
+            self._statements = []
+            return FixResult(source, False)
+        lines = _LINE_RE.findall(source)
+        with timing(stats, "parse"):
+            self._update(lines)
+        self._lines = lines
+        with timing(stats, "visit"):
+            visitor = self._visit(source)
+            visitor.resolve_typing_imports()
+        return _rewrite(source, visitor, visitor.token_funcs, stats)
+
+    def _update(self, lines: list[str]) -> None:
+        """Update the statements to the new lines, parsing as little as possible."""
+        old_lines = self._lines
+        if old_lines is None:
+            self._parse_all(lines)
+            return
+        limit = min(len(old_lines), len(lines))
+        prefix = 0
+        while prefix < limit and old_lines[prefix] == lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while (
+            suffix < limit - prefix and old_lines[-1 - suffix] == lines[-1 - suffix]
+        ):
+            suffix += 1
+        if prefix == len(old_lines) == len(lines):
+            return
+        # Keep the statements before and after the changed lines
+        first_changed = prefix + 1
+        last_changed = len(old_lines) - suffix
+        head = [s for s in self._statements if s.end < first_changed]
+        tail = self._statements[
+            bisect_left([s.start for s in self._statements], last_changed + 1) :
+        ]
+        if any(s.has_future for s in tail):
+            self._parse_all(lines)
+            return
+        line_delta = len(lines) - len(old_lines)
+        start = head[-1].end if head else 0
+        stop = tail[0].start - 1 + line_delta if tail else len(lines)
+        chunk = "".join(lines[start:stop])
+        try:
+            tree = ast.parse(chunk)
+        except SyntaxError:
+            # Let a full parse tell whether it is an error in the whole source
+            self._parse_all(lines)
+            return
+        statements = _split_statements(tree.body, start)
+        if any(s.has_future for s in statements):
+            self._parse_all(lines)
+            return
+        for statement in tail:
+            statement.move(line_delta)
+        self._statements = head + statements + tail
+
+    def _parse_all(self, lines: list[str]) -> None:
+        tree = ast.parse("".join(lines))
+        self._statements = _split_statements(tree.body)
+
+    def _visit(self, source: str) -> AnnotationVisitor:
+        """Visit the statements whose visit can't be reused, and merge what
+        was found in all of them.
+        """
+        config = self.config
+        excluded_lines = sorted(config.get_excluded_lines(source.splitlines()))
+        visitor = AnnotationVisitor([], config=config, excluded_lines=set())
+        for statement in self._statements:
+            excluded: frozenset[int] = frozenset()
+            if excluded_lines:
+                i = bisect_left(excluded_lines, statement.start)
+                j = bisect_left(excluded_lines, statement.end + 1)
+                excluded = frozenset(
+                    lineno - statement.start for lineno in excluded_lines[i:j]
+                )
+            key = (visitor.get_import_state(), excluded)
+            if statement.key != key:
+                statement.key = key
+                statement.visitor = AnnotationVisitor(
+                    [],
+                    config=config,
+                    excluded_lines={lineno + statement.base for lineno in excluded},
+                )
+                statement.visitor.set_import_state(key[0])
+                for node in statement.nodes:
+                    statement.visitor.visit(node)
+            visitor.merge(statement.visitor, statement.start - statement.base)
+        return visitor
@@ -1,39 +1,113 @@
 from __future__ import annotations
 
-import argparse
 import ast
-import difflib
+import contextlib
+import itertools
 import sys
 import os
-from pathlib import Path
-from typing import Iterator
+import time
+from collections import deque
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator
 
-from tokenize_rt import reversed_enumerate, src_to_tokens, tokens_to_src
+from fix_future_annotations._config import Config, ConfigResolver
+from fix_future_annotations._prescan import might_need_fix
+from fix_future_annotations._report import (
+    CHANGED_STATUSES,
+    FORMATS,
+    FileReport,
+    Reporter,
+    format_text,
+)
+from fix_future_annotations._stats import Stats, timing
+from fix_future_annotations._utils import Brackets, Edit, apply_edits
+from fix_future_annotations._visitor import AnnotationVisitor, TokenFunc
+from fix_future_annotations._walk import walk_python_files
 
-from fix_future_annotations._config import Config
-from fix_future_annotations._visitor import AnnotationVisitor
+# Only import what a run needs, the command line is often run on a few files
+if TYPE_CHECKING:
+    import argparse
+    from concurrent.futures import Executor, Future
+    from pathlib import Path
+
+    from fix_future_annotations._cache import Cache
 
 
 def _escaped(line: str) -> bool:
     return (len(line) - len(line.rstrip("\\"))) % 2 == 1
 
 
-def _iter_files(*paths: str, config: Config) -> Iterator[str]:
-    def files_under_dir(path: str) -> Iterator[str]:
-        for root, _, files in os.walk(path):
-            for filename in files:
-                if filename.endswith(".py"):
-                    fn = os.path.join(root, filename).replace("\\", "/")
-                    if not config.is_file_excluded(fn):
-                        yield fn
-
+def _iter_files(
+    paths: Iterable[str], *, config: Config | ConfigResolver, ignore: bool = True
+) -> Iterator[str]:
     for path in paths:
         if os.path.isdir(path):
-            yield from files_under_dir(path)
+            yield from walk_python_files(path, config=config, ignore=ignore)
         elif path.endswith(".py") and not config.is_file_excluded(path):
             yield path
 
 
+# Big enough for a lot of paths, and to tell the separator from the first read
+_READ_SIZE = 64 * 1024
+
+
+def _read_paths(file: str) -> Iterator[str]:
+    """Yield the paths listed in the file, or stdin if it is "-", as they are
+    read. The paths are separated by NUL characters if there is any when the
+    first separator is read, otherwise by newlines.
+    """
+    with contextlib.ExitStack() as stack:
+        if file == "-":
+            stream: BinaryIO = sys.stdin.buffer
+        else:
+            stream = stack.enter_context(open(file, "rb"))
+        separator = None
+        pending = b""
+        while True:
+            data = stream.read(_READ_SIZE)
+            if not data:
+                break
+            if separator is None:
+                data = pending + data
+                pending = b""
+                if b"\0" in data:
+                    separator = b"\0"
+                elif b"\n" in data:
+                    separator = b"\n"
+                else:
+                    pending = data
+                    continue
+            *items, pending = (pending + data).split(separator)
+            for item in items:
+                yield from _decode_path(item, separator)
+        yield from _decode_path(pending, separator)
+
+
+def _decode_path(item: bytes, separator: bytes | None) -> Iterator[str]:
+    if separator != b"\0":
+        item = item.rstrip(b"\r")
+    if item:
+        yield os.fsdecode(item)
+
+
+def _iter_changed_files(
+    *paths: str, changed: Iterable[str], config: Config | ConfigResolver
+) -> Iterator[str]:
+    """Like _iter_files(), but only yield the changed files under the paths.
+    The changed files are relative to the current directory, the paths may
+    be absolute or relative: both are compared as absolute paths.
+    """
+    prefixes = tuple(os.path.join(os.path.abspath(path), "") for path in paths)
+    for filename in changed:
+        absolute = os.path.abspath(filename)
+        if (
+            filename.endswith(".py")
+            and (absolute.startswith(prefixes) or absolute + os.sep in prefixes)
+            and os.path.isfile(filename)
+            and not config.is_file_excluded(filename)
+        ):
+            yield filename
+
+
 def _add_future_annotations(content: str) -> str:
     """Add from __future__ annotations after the first docstring and comments"""
     new_lines = ["from __future__ import annotations\n"]
@@ -84,54 +158,458 @@ def _add_future_annotations(content: str) -> str:
     return "".join(lines)
 
 
+class FixResult:
+    """The result of fixing a piece of source code."""
+
+    _fields = ("source", "changed", "edits", "added_future_import")
+
+    def __init__(
+        self,
+        source: str,
+        changed: bool,
+        edits: dict[str, int] | None = None,
+        added_future_import: bool = False,
+    ) -> None:
+        # The fixed source code
+        self.source = source
+        # Whether the source code is changed
+        self.changed = changed
+        # The number of rewrites by kind, see fix_future_annotations._visitor
+        self.edits: dict[str, int] = {} if edits is None else edits
+        # Whether `from __future__ import annotations` is added
+        self.added_future_import = added_future_import
+
+    def __repr__(self) -> str:
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({args})"
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+    __hash__ = None  # type: ignore[assignment]
+
+
+def fix_source(
+    source: str, *, config: Config | None = None, stats: Stats | None = None
+) -> FixResult:
+    """Fix the source code to use PEP 585, 604 and 563 syntax.
+
+    Nothing is read from or written to the disk, the default configuration is
+    used unless one is given. If stats are given, the timings of the phases
+    are added to them.
+    """
+    if config is None:
+        config = Config()
+    with timing(stats, "prescan"):
+        need_fix = might_need_fix(source)
+    if stats is not None:
+        stats.counts["sources"] += 1
+        stats.counts["skipped"] += not need_fix
+    if not need_fix:
+        return FixResult(source, False)
+    with timing(stats, "parse"):
+        tree = ast.parse(source)
+    with timing(stats, "visit"):
+        visitor = AnnotationVisitor(source.splitlines(), config=config)
+        token_funcs = visitor.get_token_functions(tree)
+    return _rewrite(source, visitor, token_funcs, stats)
+
+
+def _rewrite(
+    source: str,
+    visitor: AnnotationVisitor,
+    token_funcs: dict[tuple[int, int], list[TokenFunc]],
+    stats: Stats | None,
+) -> FixResult:
+    """Run the token functions found by the visitor on the source."""
+    if token_funcs:
+        # Tokenizing is expensive, only do it when there is something to rewrite
+        with timing(stats, "tokenize"):
+            from tokenize_rt import src_to_tokens
+
+            tokens = src_to_tokens(source)
+        with timing(stats, "edit"):
+            brackets = Brackets(tokens)
+            edits: list[Edit] = []
+            for i, token in enumerate(tokens):
+                if not token.src:
+                    continue
+                for func in token_funcs.get(token.offset, []):
+                    edits.extend(func(i, tokens, brackets))
+            new_source = apply_edits(tokens, edits)
+    else:
+        new_source = source
+
+    new_source = new_source.lstrip()
+    added_future_import = visitor.need_future_annotations
+    if added_future_import:
+        with timing(stats, "future_import"):
+            new_source = _add_future_annotations(new_source)
+    if stats is not None:
+        stats.counts["changed"] += new_source != source
+    return FixResult(
+        new_source,
+        new_source != source,
+        dict(visitor.edit_counts),
+        added_future_import,
+    )
+
+
+def check_source(
+    source: str, *, config: Config | None = None, stats: Stats | None = None
+) -> tuple[int, int] | None:
+    """Return the line and column(both starting at 1) of a place of the
+    source code that needs a fix, or None if it needs none.
+
+    The source needs a fix whenever fix_source() would change it, but nothing
+    is rewritten: the syntax tree is only visited until a fix is found.
+    """
+    if config is None:
+        config = Config()
+    with timing(stats, "prescan"):
+        need_fix = might_need_fix(source)
+    if stats is not None:
+        stats.counts["sources"] += 1
+        stats.counts["skipped"] += not need_fix
+    if not need_fix:
+        return None
+    with timing(stats, "parse"):
+        tree = ast.parse(source)
+    with timing(stats, "visit"):
+        visitor = AnnotationVisitor(source.splitlines(), config=config)
+        offset = visitor.find_first_fix(tree)
+    if offset is not None:
+        location = (offset[0], offset[1] + 1)
+    elif source[:1].isspace():
+        # The leading whitespace is stripped
+        location = (1, 1)
+    else:
+        return None
+    if stats is not None:
+        stats.counts["changed"] += 1
+    return location
+
+
+def fix_sources(
+    sources: Iterable[str],
+    *,
+    config: Config | None = None,
+    jobs: int = 1,
+    stats: Stats | None = None,
+) -> Iterator[FixResult]:
+    """Fix many pieces of source code with the same configuration, yielding
+    the results in order. With ``jobs`` greater than 1, the work is spread
+    over that many worker processes.
+    """
+    if config is None:
+        config = Config()
+    if jobs <= 1:
+        for source in sources:
+            yield fix_source(source, config=config, stats=stats)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(config, None)
+    ) as executor:
+        results = executor.map(
+            _fix_source_in_worker,
+            sources,
+            itertools.repeat(stats is not None),
+            chunksize=16,
+        )
+        for result, worker_stats in results:
+            if worker_stats is not None:
+                stats.merge(worker_stats)
+            yield result
+
+
+def _format_diff(old: str, new: str) -> str:
+    from fix_future_annotations._diff import unified_diff
+
+    diff = unified_diff(
+        old.splitlines(), new.splitlines(), fromfile="old", tofile="new"
+    )
+    return "\n".join(diff)
+
+
 def fix_file(
     file_path: str | Path,
     *,
     write: bool = False,
     show_diff: bool = False,
     config: Config | None = None,
+    cache: Cache | None = None,
+    stats: Stats | None = None,
 ) -> bool:
-    """Fix the file at file_path to use PEP 585, 604 and 563 syntax."""
+    """Fix the file at file_path to use PEP 585, 604 and 563 syntax.
+
+    If no config is given, the one of the nearest pyproject.toml is used.
+    If a cache is given, files that are known to need no fix are skipped
+    and files found to need no fix are recorded in it. If stats are given,
+    the timings of the phases are added to them.
+    """
     if config is None:
-        config = Config.from_file()
-    file_path = Path(file_path)
-    file_content = file_path.read_text("utf-8")
-    tokens = src_to_tokens(file_content)
-    tree = ast.parse(file_content)
-    visitor = AnnotationVisitor(file_content.splitlines(), config=config)
-    token_funcs = visitor.get_token_functions(tree)
-    for i, token in reversed_enumerate(tokens):
-        if not token.src:
-            continue
-        for func in token_funcs.get(token.offset, []):
-            func(i, tokens)
-
-    new_content = tokens_to_src(tokens).lstrip()
-    if visitor.need_future_annotations:
-        new_content = _add_future_annotations(new_content)
-
-    diff = list(
-        difflib.unified_diff(
-            file_content.splitlines(),
-            new_content.splitlines(),
-            fromfile="old",
-            tofile="new",
-        )
+        config = ConfigResolver().for_path(file_path)
+    report = _fix_path(
+        file_path,
+        write=write,
+        show_diff=show_diff,
+        config=config,
+        cache=cache,
+        stats=stats,
     )
-    if diff:
-        if show_diff:
-            print(*diff, sep="\n")
-        if write:
-            print("Fixing file:", file_path)
-            file_path.write_text(new_content, "utf-8")
+    sys.stdout.write(format_text(report))
+    return report["status"] in CHANGED_STATUSES
+
+
+def _fix_path(
+    file_path: str | Path,
+    *,
+    write: bool,
+    show_diff: bool,
+    config: Config,
+    cache: Cache | None,
+    stats: Stats | None,
+    report_edits: bool = False,
+) -> FileReport:
+    """Fix the file like fix_file() does, but return the report of the file
+    instead of printing it.
+
+    When only checking, the report of a file to fix has the location of the
+    first fix, or the edits if ``report_edits`` is true, which takes a full
+    fix of the file.
+    """
+    start = time.perf_counter()
+    with timing(stats, "read"):
+        with open(file_path, encoding="utf-8") as f:
+            file_content = f.read()
+    if stats is not None:
+        stats.counts["files"] += 1
+    report: FileReport = {"path": os.fspath(file_path)}
+    is_clean = False
+    if cache is not None:
+        with timing(stats, "cache"):
+            is_clean = cache.is_clean(file_content, config)
+    if is_clean:
+        if stats is not None:
+            stats.counts["cached"] += 1
+        result = FixResult(file_content, False)
+        report["status"] = "cached"
+    elif not write and not show_diff and not report_edits:
+        # Only checking, there is no need to rewrite the file
+        location = check_source(file_content, config=config, stats=stats)
+        if location is not None:
+            report["status"] = "needs_fix"
+            report["line"], report["column"] = location
+            return _finish_report(report, start, stats)
+        result = FixResult(file_content, False)
+        report["status"] = "unchanged"
+        if cache is not None:
+            with timing(stats, "cache"):
+                cache.mark_clean(file_content, config)
+    else:
+        result = fix_source(file_content, config=config, stats=stats)
+        if not result.changed:
+            report["status"] = "unchanged"
+            if cache is not None:
+                with timing(stats, "cache"):
+                    cache.mark_clean(file_content, config)
+        elif write:
+            report["status"] = "fixed"
+            with timing(stats, "write"):
+                with open(file_path, "w", encoding="utf-8") as f:
+                    f.write(result.source)
         else:
-            print("File needs to be fixed:", file_path)
-    return bool(diff)
+            report["status"] = "needs_fix"
+    report["edits"] = result.edits
+    report["added_future_import"] = result.added_future_import
+    if show_diff and result.changed:
+        with timing(stats, "diff"):
+            report["diff"] = _format_diff(file_content, result.source)
+    return _finish_report(report, start, stats)
+
+
+def _finish_report(report: FileReport, start: float, stats: Stats | None) -> FileReport:
+    report["seconds"] = seconds = time.perf_counter() - start
+    if stats is not None:
+        stats.add_file(report["path"], seconds)
+    return report
+
+
+_worker_config: Config | ConfigResolver | None = None
+_worker_cache: Cache | None = None
+
+
+def _init_worker(config: Config | ConfigResolver, cache: Cache | None) -> None:
+    global _worker_config, _worker_cache
+    _worker_config = config
+    _worker_cache = cache
+
+
+def _fix_files_in_worker(
+    file_paths: list[str],
+    write: bool,
+    show_diff: bool,
+    with_stats: bool,
+    report_edits: bool,
+) -> tuple[list[FileReport], set[str], Stats | None]:
+    """Fix the files in a worker process, returning their reports so that the
+    parent can output the reports in the original file order.
+    """
+    stats = Stats() if with_stats else None
+    reports = []
+    for file_path in file_paths:
+        config = _worker_config
+        if isinstance(config, ConfigResolver):
+            config = config.for_path(file_path)
+        reports.append(
+            _fix_path(
+                file_path,
+                write=write,
+                show_diff=show_diff,
+                config=config,
+                cache=_worker_cache,
+                stats=stats,
+                report_edits=report_edits,
+            )
+        )
+    written: set[str] = set()
+    if _worker_cache is not None:
+        # The buckets written to, for the parent to prune
+        written, _worker_cache.written = _worker_cache.written, set()
+    return reports, written, stats
+
+
+# The number of files sent to a worker at once, and of such batches in flight
+# by worker: enough to keep the workers busy without holding all the files.
+_BATCH_SIZE = 8
+_BATCHES_BY_WORKER = 4
+
+
+def _fix_files_in_pool(
+    executor: Executor,
+    file_paths: Iterable[str],
+    *,
+    jobs: int,
+    write: bool,
+    show_diff: bool,
+    with_stats: bool,
+    report_edits: bool,
+) -> Iterator[tuple[list[FileReport], set[str], Stats | None]]:
+    """Yield the results of _fix_files_in_worker() in order, taking the files
+    lazily. The batches not done yet are cancelled when the generator is
+    closed.
+    """
+    pending: deque[Future[tuple[list[FileReport], set[str], Stats | None]]] = deque()
+    file_paths = iter(file_paths)
+    try:
+        while True:
+            batch = list(itertools.islice(file_paths, _BATCH_SIZE))
+            if not batch:
+                break
+            pending.append(
+                executor.submit(
+                    _fix_files_in_worker,
+                    batch,
+                    write,
+                    show_diff,
+                    with_stats,
+                    report_edits,
+                )
+            )
+            if len(pending) >= jobs * _BATCHES_BY_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _fix_source_in_worker(
+    source: str, with_stats: bool
+) -> tuple[FixResult, Stats | None]:
+    stats = Stats() if with_stats else None
+    return fix_source(source, config=_worker_config, stats=stats), stats
+
 
+def _parse_jobs(value: str) -> int:
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        import argparse
 
-def main(argv: list[str] | None = None) -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument("path", nargs="+", help="File or directory path(s) to fix")
+        raise argparse.ArgumentTypeError(
+            f"must be a positive integer or 'auto', got {value!r}"
+        )
+    return jobs
+
+
+def _parse_shard(value: str) -> tuple[int, int]:
+    index, _, count = value.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        shard = (0, 0)
+    if not 1 <= shard[0] <= shard[1]:
+        import argparse
+
+        raise argparse.ArgumentTypeError(
+            f"must be K/N with 1 <= K <= N, e.g. 1/4, got {value!r}"
+        )
+    return shard
+
+
+def _fix_stdin(
+    *,
+    write: bool,
+    show_diff: bool,
+    config: Config,
+    filename: str | None,
+    stats: Stats | None = None,
+) -> bool:
+    """Fix the source read from stdin. In write mode, the fixed source is
+    written to stdout, so any message goes to stderr.
+    """
+    with timing(stats, "read"):
+        source = sys.stdin.buffer.read().decode("utf-8")
+    if filename is not None and config.is_file_excluded(filename):
+        result = FixResult(source, False)
+    else:
+        result = fix_source(source, config=config, stats=stats)
+    if write:
+        sys.stdout.buffer.write(result.source.encode("utf-8"))
+        sys.stdout.flush()
+    if result.changed:
+        if show_diff:
+            with timing(stats, "diff"):
+                print(_format_diff(source, result.source), file=sys.stderr)
+        if not write:
+            print("File needs to be fixed:", filename or "-", file=sys.stderr)
+    return result.changed
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    import argparse
+
+    from fix_future_annotations._shard import SHARD_MODES
+
+    parser = argparse.ArgumentParser(
+        epilog="Run `%(prog)s daemon` to start a server that keeps the "
+        "configuration warm for the clients started with --use-daemon."
+    )
+    parser.add_argument(
+        "path",
+        nargs="*",
+        help="File or directory path(s) to fix, or '-' to read from stdin",
+    )
     parser.add_argument(
         "--check",
         "-c",
@@ -143,23 +621,287 @@ def main(argv: list[str] | None = None) -> None:
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Show diff details"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=_parse_jobs,
+        default=1,
+        help="Number of worker processes, or 'auto' to use all CPUs (default: 1)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        default=True,
+        action="store_false",
+        help="Do not read or write the cache of files known to need no fix",
+    )
+    parser.add_argument(
+        "--files-from",
+        metavar="FILE",
+        help="Also fix the paths listed in this file, or stdin if '-', separated "
+        "by newlines or NUL characters",
+    )
+    parser.add_argument(
+        "--stdin-filename",
+        help="The path of the file read from stdin, to match exclude_files against",
+    )
+    parser.add_argument(
+        "--use-daemon",
+        action="store_true",
+        help="Send the work to the running daemon if any, otherwise do it in "
+        "this process",
+    )
+    parser.add_argument(
+        "--no-ignore",
+        dest="ignore",
+        default=True,
+        action="store_false",
+        help="Also look into the directories skipped by default(e.g. .venv, "
+        "build) and the files ignored by .gitignore and .ignore files",
+    )
+    parser.add_argument(
+        "--config",
+        metavar="FILE",
+        help="Use the configuration in this file for all the files, instead of "
+        "the one of the nearest pyproject.toml",
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="text",
+        help="The output format: text for humans, or a JSON document or JSON "
+        "Lines with a report of each file for tools (default: text)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and fix the files again as they change",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop at the first file that needs to be fixed",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the time spent in each phase, the file counts and the "
+        "10 slowest files to stderr",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Dump the cProfile data of the run to this file, the worker "
+        "processes are not profiled",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="K/N",
+        type=_parse_shard,
+        help="Only check the K-th of N stable parts of the files, e.g. to split "
+        "the work between CI nodes",
+    )
+    parser.add_argument(
+        "--shard-by",
+        choices=SHARD_MODES,
+        default="path",
+        help="Split the files by a hash of their path in the repository, or "
+        "into parts of about the same size (default: path)",
+    )
+    changed = parser.add_mutually_exclusive_group()
+    changed.add_argument(
+        "--changed-since",
+        metavar="REF",
+        help="Only check the files changed since the git ref, e.g. origin/main",
+    )
+    changed.add_argument(
+        "--staged", action="store_true", help="Only check the files staged in git"
+    )
+    return parser
+
+
+def _parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = _build_parser()
     args = parser.parse_args(argv)
-    diff_count = 0
-    checked = 0
-    config = Config.from_file()
-    for filename in _iter_files(*args.path, config=config):
-        checked += 1
-        result = fix_file(
-            filename, write=args.write, show_diff=args.verbose, config=config
+    if not args.path and args.files_from is None:
+        parser.error("the following arguments are required: path")
+    if args.files_from is not None and (
+        args.path == ["-"] or args.changed_since is not None or args.staged
+    ):
+        parser.error(
+            "--files-from can't be used together with '-', --changed-since or "
+            "--staged"
         )
-        diff_count += int(result)
-    if diff_count:
-        if args.write:
-            message = f"All complete, {diff_count} files were fixed"
+    if args.watch and (
+        args.path == ["-"]
+        or args.files_from is not None
+        or args.changed_since is not None
+        or args.staged
+    ):
+        parser.error(
+            "--watch can't be used together with '-', --files-from, "
+            "--changed-since or --staged"
+        )
+    if "-" in args.path and len(args.path) > 1:
+        parser.error("'-' can't be used together with other paths")
+    if args.path == ["-"] and (args.changed_since is not None or args.staged):
+        parser.error("'-' can't be used together with --changed-since or --staged")
+    if args.path == ["-"] and args.format != "text":
+        parser.error("'-' can't be used together with --format")
+    if args.path == ["-"] and args.shard is not None:
+        parser.error("'-' can't be used together with --shard")
+    if args.config is not None and not os.path.isfile(args.config):
+        parser.error(f"config file not found: {args.config}")
+    return args
+
+
+def _run(args: argparse.Namespace, resolver: ConfigResolver) -> int:
+    """Run the command with the parsed arguments and return the exit code."""
+    stats = Stats() if args.stats else None
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        return _run_command(args, resolver, stats)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if stats is not None:
+            print(stats.format(), file=sys.stderr)
+
+
+def _run_command(
+    args: argparse.Namespace, resolver: ConfigResolver, stats: Stats | None
+) -> int:
+    if args.path == ["-"]:
+        if args.stdin_filename is not None:
+            config = resolver.for_path(args.stdin_filename)
         else:
-            message = f"All complete, {diff_count} files need to be fixed"
-        if checked > 1:  # multiple mode, print a summary
-            print(message)
-        sys.exit(1)
-    elif checked > 1:
-        print("All complete, no file is changed")
+            config = resolver.for_dir(".")
+        changed = _fix_stdin(
+            write=args.write,
+            show_diff=args.verbose,
+            config=config,
+            filename=args.stdin_filename,
+            stats=stats,
+        )
+        return int(changed)
+    reporter = Reporter(args.format, write=args.write, shard=args.shard)
+    fail_fast = args.fail_fast
+    # The reports for tools have the edits of the files to fix
+    report_edits = args.format != "text"
+    cache = None
+    if args.cache:
+        from fix_future_annotations._cache import Cache
+
+        cache = Cache(resolver.for_dir("."))
+    changed = None
+    if args.changed_since is not None or args.staged:
+        from fix_future_annotations._git import get_changed_files
+
+        changed = get_changed_files(since=args.changed_since, staged=args.staged)
+        if changed is None:
+            print(
+                "Failed to get the changed files from git, checking all the files",
+                file=sys.stderr,
+            )
+    if changed is None:
+        paths: Iterable[str] = args.path
+        if args.files_from is not None:
+            paths = itertools.chain(paths, _read_paths(args.files_from))
+        filenames = _iter_files(paths, config=resolver, ignore=args.ignore)
+    else:
+        filenames = _iter_changed_files(*args.path, changed=changed, config=resolver)
+    if args.shard is not None:
+        from fix_future_annotations._shard import select_shard
+
+        index, count = args.shard
+        filenames = select_shard(filenames, index - 1, count, mode=args.shard_by)
+    if stats is not None:
+        filenames = stats.time_iter("walk", filenames)
+    parallel = False
+    if args.jobs > 1:
+        # Don't start the workers for a single file
+        first = list(itertools.islice(filenames, 2))
+        parallel = len(first) > 1
+        filenames = itertools.chain(first, filenames)
+    if parallel:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=_init_worker,
+            initargs=(resolver, cache),
+        ) as executor:
+            results = _fix_files_in_pool(
+                executor,
+                filenames,
+                jobs=args.jobs,
+                write=args.write,
+                show_diff=args.verbose,
+                with_stats=stats is not None,
+                report_edits=report_edits,
+            )
+            with contextlib.closing(results):
+                for reports, written, worker_stats in results:
+                    if written:
+                        cache.written |= written
+                    if worker_stats is not None:
+                        stats.merge(worker_stats)
+                    for report in reports:
+                        reporter.add(report)
+                        if fail_fast and reporter.changed:
+                            reporter.stopped = True
+                            break
+                    if reporter.stopped:
+                        break
+    else:
+        for filename in filenames:
+            report = _fix_path(
+                filename,
+                write=args.write,
+                show_diff=args.verbose,
+                config=resolver.for_path(filename),
+                cache=cache,
+                stats=stats,
+                report_edits=report_edits,
+            )
+            reporter.add(report)
+            if fail_fast and reporter.changed:
+                reporter.stopped = True
+                break
+    if cache is not None:
+        cache.prune()
+    reporter.finish()
+    return int(reporter.changed > 0)
+
+
+def main(argv: list[str] | None = None, *, use_daemon: bool = True) -> None:
+    """Run the command line. The daemon is only tried if ``use_daemon`` is
+    true, the entry point in fix_future_annotations._client has tried it
+    already.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["daemon"]:
+        from fix_future_annotations._daemon import serve_forever
+
+        sys.exit(serve_forever(argv[1:]))
+    args = _parse_args(argv)
+    if args.watch:
+        from fix_future_annotations._watch import Watcher
+
+        sys.exit(Watcher(args).run())
+    code: int | None = None
+    if args.use_daemon and use_daemon:
+        from fix_future_annotations._client import run_client
+
+        code = run_client(argv, stdin=args.path == ["-"] or args.files_from == "-")
+    if code is None:
+        code = _run(args, ConfigResolver(args.config))
+    if code or args.path == ["-"]:
+        sys.exit(code)
@@ -0,0 +1,100 @@
+"""A cheap, conservative scan to skip the files that can't need a fix.
+
+Without any mention of ``typing``(which also covers ``typing_extensions``),
+the only things the visitor may change or react to are string constants,
+binary operators and builtin generic subscripts(e.g. ``list[int]``) inside
+an annotation. This module looks for those with a couple of regular
+expressions instead of tokenizing and parsing the source.
+"""
+
+from __future__ import annotations
+
+import re
+
+_STRING = r"""
+    '''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''
+  | \"\"\"[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*\"\"\"
+  | '[^'\\\r\n]*(?:\\.[^'\\\r\n]*)*'
+  | "[^"\\\r\n]*(?:\\.[^"\\\r\n]*)*"
+"""
+
+# Outside of an annotation, look for where an annotation may start while
+# keeping track of the brackets.
+_OUTSIDE_RE = re.compile(
+    rf"""
+    (?P<string>{_STRING})
+  | (?P<quote>['"])  # an unterminated string, give up
+  | (?P<comment>\#[^\r\n]*)
+  | (?P<open>[(\[{{])
+  | (?P<close>[)\]}}])
+  | (?P<start>->|:(?!=))
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Inside of an annotation, look for anything that may need a fix or for where
+# the annotation ends.
+_INSIDE_RE = re.compile(
+    r"""
+    (?P<hit>
+        ['"]
+      | ==
+      | [|&^~@%+*/<>!]
+      | -(?!>)
+      | (?<![\w.])(?:list|dict|set|frozenset|tuple|type)\s*\[
+    )
+  | (?P<comment>\#[^\r\n]*)
+  | (?P<continuation>\\\r?\n)
+  | (?P<open>[(\[{])
+  | (?P<close>[)\]}])
+  | (?P<end>[,;:]|=)
+  | (?P<newline>\r\n?|\n)
+    """,
+    re.VERBOSE,
+)
+
+_PAIRS = {")": "(", "]": "[", "}": "{"}
+
+
+def might_need_fix(source: str) -> bool:
+    """Return False if the source can't need any fix.
+
+    The scan errs on the side of caution: a True result only means that the
+    full analysis must run.
+    """
+    if "typing" in source or source[:1].isspace():
+        return True
+    brackets: list[str] = []
+    # The bracket depth where the current annotation starts, or -1 if not
+    # in an annotation.
+    annotation_depth = -1
+    pos = 0
+    while True:
+        if annotation_depth < 0:
+            match = _OUTSIDE_RE.search(source, pos)
+        else:
+            match = _INSIDE_RE.search(source, pos)
+        if match is None:
+            return bool(brackets)
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "hit" or kind == "quote":
+            return True
+        elif kind == "open":
+            brackets.append(match.group())
+        elif kind == "close":
+            if not brackets or brackets.pop() != _PAIRS[match.group()]:
+                return True
+            if len(brackets) < annotation_depth:
+                annotation_depth = -1
+        elif kind == "start":
+            # Annotations only live at the top level of a statement or in
+            # the parameter list of a function.
+            if not brackets or brackets[-1] == "(":
+                annotation_depth = len(brackets)
+        elif kind == "end":
+            if len(brackets) == annotation_depth:
+                annotation_depth = -1
+        elif kind == "newline":
+            if not brackets:
+                annotation_depth = -1
@@ -0,0 +1,123 @@
+"""The output of a run on files, as text for humans or JSON for tools.
+
+Every checked file gets a report, a dict with the keys:
+- path: the path of the file
+- status: one of STATUSES
+- edits: the number of rewrites by kind, see fix_future_annotations._visitor
+- added_future_import: whether `from __future__ import annotations` is added
+- line, column: where the first fix is, instead of edits and
+  added_future_import in the text format when only checking a file that
+  needs to be fixed
+- seconds: the time spent on the file
+- diff: the unified diff of the fix, only with --verbose and if changed
+
+The text format prints the changed files only, as soon as they are done.
+The JSON format writes a single document with all the reports and a summary
+at the end, and the JSON Lines format writes a line per file followed by a
+line with the summary.
+"""
+
+from __future__ import annotations
+
+import sys
+from typing import Any, Dict
+
+FileReport = Dict[str, Any]
+
+FORMATS = ("text", "json", "jsonl")
+# The file is fixed, needs to be fixed(in check mode), needs no fix, or is
+# known to need no fix from the cache
+STATUSES = ("fixed", "needs_fix", "unchanged", "cached")
+CHANGED_STATUSES = ("fixed", "needs_fix")
+
+
+def format_text(report: FileReport) -> str:
+    """Return the lines printed for the file in the text format."""
+    if report["status"] not in CHANGED_STATUSES:
+        return ""
+    # Printed as a Path like it always was, e.g. "./foo.py" as "foo.py"
+    from pathlib import Path
+
+    path = Path(report["path"])
+    lines = []
+    if "diff" in report:
+        lines.append(report["diff"] + "\n")
+    if report["status"] == "fixed":
+        lines.append(f"Fixing file: {path}\n")
+    elif "line" in report:
+        location = f"{path}:{report['line']}:{report['column']}"
+        lines.append(f"File needs to be fixed: {location}\n")
+    else:
+        lines.append(f"File needs to be fixed: {path}\n")
+    return "".join(lines)
+
+
+class Reporter:
+    """Write the reports of the files and the summary of a run."""
+
+    def __init__(
+        self,
+        format: str = "text",
+        *,
+        write: bool = True,
+        shard: tuple[int, int] | None = None,
+    ) -> None:
+        self.format = format
+        self.write = write
+        # The (K, N) of the K-th shard out of N that is checked, if any
+        self.shard = shard
+        self.checked = 0
+        self.changed = 0
+        # Whether the run is stopped at the first file to fix
+        self.stopped = False
+        self._reports: list[FileReport] = []
+
+    def add(self, report: FileReport) -> None:
+        self.checked += 1
+        self.changed += report["status"] in CHANGED_STATUSES
+        if self.format == "text":
+            sys.stdout.write(format_text(report))
+        elif self.format == "jsonl":
+            import json
+
+            sys.stdout.write(json.dumps(report) + "\n")
+        else:
+            # Written at once in finish()
+            self._reports.append(report)
+
+    def summary(self) -> dict[str, Any]:
+        summary = {
+            "checked": self.checked,
+            "changed": self.changed,
+            "write": self.write,
+            "stopped": self.stopped,
+        }
+        if self.shard is not None:
+            summary["shard"] = "{}/{}".format(*self.shard)
+        return summary
+
+    def finish(self) -> None:
+        """Write the summary of the run."""
+        if self.format == "text":
+            # Only a summary of multiple files
+            if self.checked <= 1:
+                return
+            if self.stopped:
+                message = "Stopped at the first file to fix"
+            elif not self.changed:
+                message = "All complete, no file is changed"
+            elif self.write:
+                message = f"All complete, {self.changed} files were fixed"
+            else:
+                message = f"All complete, {self.changed} files need to be fixed"
+            if self.shard is not None:
+                message += " in shard {}/{}".format(*self.shard)
+            print(message)
+            return
+        import json
+
+        if self.format == "jsonl":
+            sys.stdout.write(json.dumps({"summary": self.summary()}) + "\n")
+        else:
+            document = {"files": self._reports, "summary": self.summary()}
+            sys.stdout.write(json.dumps(document, indent=2) + "\n")
@@ -0,0 +1,83 @@
+"""Split the files to check between several runs, e.g. on CI nodes.
+
+Each file goes to one of N shards, the same one in every run so that the
+shards cover all the files exactly once:
+- by path, the shard is given by a hash of the path relative to the root of
+  the repository, so adding or removing a file doesn't move the others
+- by size, the files are dealt from the largest to the least loaded shard, so
+  that the shards have about the same number of bytes to check
+"""
+
+from __future__ import annotations
+
+import heapq
+import os
+from typing import Iterable, Iterator
+
+SHARD_MODES = ("path", "size")
+
+
+def find_root(path: str = ".") -> str:
+    """Return the root of the git repository containing the directory, or the
+    absolute path of the directory if it is not in one.
+    """
+    path = os.path.abspath(path)
+    parent = path
+    while True:
+        if os.path.exists(os.path.join(parent, ".git")):
+            return parent
+        parent, child = os.path.dirname(parent), parent
+        if parent == child:
+            return path
+
+
+def _key(path: str, root: str) -> str:
+    return os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+
+
+def shard_of(path: str, count: int, *, root: str) -> int:
+    """Return the shard, from 0 to count - 1, of the path by its hash."""
+    # Not imported with the module, loading OpenSSL takes a few milliseconds
+    import hashlib
+
+    digest = hashlib.sha1(_key(path, root).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def select_shard(
+    paths: Iterable[str],
+    index: int,
+    count: int,
+    *,
+    mode: str = "path",
+    root: str | None = None,
+) -> Iterator[str]:
+    """Yield the paths in the shard ``index``(from 0) out of ``count``, in
+    their original order.
+    """
+    if root is None:
+        root = find_root()
+    if mode == "path":
+        for path in paths:
+            if shard_of(path, count, root=root) == index:
+                yield path
+        return
+    paths = list(paths)
+    # Break the ties by path, so that every run deals the files the same way
+    # whatever the order they are found in.
+    files = sorted(((-_size(path), _key(path, root), path) for path in paths))
+    loads = [(0, shard) for shard in range(count)]
+    selected = set()
+    for negative_size, _, path in files:
+        load, shard = heapq.heappop(loads)
+        if shard == index:
+            selected.add(path)
+        heapq.heappush(loads, (load - negative_size, shard))
+    yield from (path for path in paths if path in selected)
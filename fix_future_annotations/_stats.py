@@ -0,0 +1,111 @@
+"""Timings of the phases of a run, for ``--stats`` and for embedding code.
+
+Pass a Stats to fix_source(), fix_sources() or fix_file() and it collects
+the time spent in each phase, the number of files by outcome and the slowest
+files. Stats from several runs or worker processes can be merged.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import heapq
+import time
+from collections import Counter
+from typing import ContextManager, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+# In pipeline order
+PHASES = (
+    "walk",
+    "read",
+    "cache",
+    "prescan",
+    "parse",
+    "visit",
+    "tokenize",
+    "edit",
+    "future_import",
+    "diff",
+    "write",
+)
+
+_NO_TIMING = contextlib.nullcontext()
+
+
+class Stats:
+    """Cumulative timings by phase, file counts and the slowest files."""
+
+    def __init__(self, slowest: int = 10) -> None:
+        # Seconds spent by phase
+        self.phases: Counter[str] = Counter()
+        # Number of files read, of files known to need no fix from the
+        # cache, of sources fixed, of sources skipped by the prescan and of
+        # sources changed
+        self.counts: Counter[str] = Counter()
+        # The number of slowest files to keep
+        self.slowest = slowest
+        # A min-heap of (seconds, path) of the slowest files
+        self._slowest_files: list[tuple[float, str]] = []
+
+    @contextlib.contextmanager
+    def _timing(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def time_iter(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        """Yield from the iterable, adding the time spent in it to the phase."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.phases[name] += time.perf_counter() - start
+            yield item
+
+    def add_file(self, path: str, seconds: float) -> None:
+        """Record the total time spent on a file."""
+        item = (seconds, path)
+        if len(self._slowest_files) < self.slowest:
+            heapq.heappush(self._slowest_files, item)
+        elif item > self._slowest_files[0]:
+            heapq.heapreplace(self._slowest_files, item)
+
+    def slowest_files(self) -> list[tuple[float, str]]:
+        """Return the (seconds, path) of the slowest files, slowest first."""
+        return sorted(self._slowest_files, reverse=True)
+
+    def merge(self, other: Stats) -> None:
+        """Add the stats of another run, e.g. from a worker process."""
+        self.phases.update(other.phases)
+        self.counts.update(other.counts)
+        for seconds, path in other._slowest_files:
+            self.add_file(path, seconds)
+
+    def format(self) -> str:
+        """Return the stats as a human readable report."""
+        total = sum(self.phases.values())
+        lines = ["Files: " + ", ".join(f"{k} {v}" for k, v in self.counts.items())]
+        lines.append("Phases:")
+        for name in PHASES:
+            if name in self.phases:
+                seconds = self.phases[name]
+                share = seconds / total if total else 0
+                lines.append(f"  {name:<14}{seconds:>10.3f}s {share:>6.1%}")
+        lines.append(f"  {'total':<14}{total:>10.3f}s")
+        if self._slowest_files:
+            lines.append("Slowest files:")
+            for seconds, path in self.slowest_files():
+                lines.append(f"  {seconds:>10.3f}s  {path}")
+        return "\n".join(lines)
+
+
+def timing(stats: Stats | None, name: str) -> ContextManager[None]:
+    """Time the block as the phase, if stats are collected."""
+    return _NO_TIMING if stats is None else stats._timing(name)
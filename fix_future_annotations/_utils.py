@@ -1,28 +1,123 @@
 from __future__ import annotations
 
-from tokenize_rt import Token, Offset
 from ast import AST
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple
 
+if TYPE_CHECKING:
+    from tokenize_rt import Token
 
-def replace_name(i: int, tokens: list[Token], *, name: str, new: str) -> None:
+
+class Edit(NamedTuple):
+    """Replace ``tokens[start:end]`` with ``src``."""
+
+    start: int
+    end: int
+    src: str
+
+
+class EditConflictError(ValueError):
+    """Raised when two edits touch the same tokens."""
+
+
+def apply_edits(tokens: list[Token], edits: Iterable[Edit]) -> str:
+    """Apply the non-overlapping edits to the tokens and return the new source,
+    in one pass over the tokens.
+    """
+    parts: list[str] = []
+    pos = 0
+    last: Edit | None = None
+    for edit in sorted(set(edits)):
+        if edit.start < pos or (last is not None and edit.start == last.start):
+            token = tokens[edit.start]
+            raise EditConflictError(
+                f"Conflicting edits at line {token.line}, "
+                f"column {token.utf8_byte_offset}: {last} and {edit}"
+            )
+        parts.extend(token.src for token in tokens[pos : edit.start])
+        parts.append(edit.src)
+        pos = edit.end
+        last = edit
+    parts.extend(token.src for token in tokens[pos:])
+    return "".join(parts)
+
+
+class Brackets:
+    """The matching brackets of the tokens, with the brackets and the commas
+    directly inside each pair.
+
+    The index is built in one pass over the tokens, the first time it is
+    needed, and shared by all the rewrites of a file so that nested
+    subscripts are not scanned again at each level.
+    """
+
+    def __init__(self, tokens: list[Token]) -> None:
+        self._tokens = tokens
+        self._closing: dict[int, int] | None = None
+        self._children: dict[int, list[int]] = {}
+        self._commas: dict[int, list[int]] = {}
+
+    def _build(self) -> dict[int, int]:
+        closing: dict[int, int] = {}
+        # The index of the opening brackets not closed yet
+        stack: list[int] = []
+        for i, token in enumerate(self._tokens):
+            # Not the text of an f-string(FSTRING_MIDDLE since Python 3.12)
+            if token.name != "OP":
+                continue
+            src = token.src
+            if src in ("(", "[", "{"):
+                if stack:
+                    self._children.setdefault(stack[-1], []).append(i)
+                stack.append(i)
+            elif src in (")", "]", "}"):
+                closing[stack.pop()] = i
+            elif src == "," and stack:
+                self._commas.setdefault(stack[-1], []).append(i)
+        self._closing = closing
+        return closing
+
+    def closing(self, i: int) -> int:
+        """Return the index of the bracket closing the one at i."""
+        closing = self._closing if self._closing is not None else self._build()
+        return closing[i]
+
+    def children(self, i: int) -> list[int]:
+        """Return the indexes of the opening brackets directly inside the
+        bracket at i.
+        """
+        if self._closing is None:
+            self._build()
+        return self._children.get(i, [])
+
+    def commas(self, i: int) -> list[int]:
+        """Return the indexes of the commas directly inside the bracket at i."""
+        if self._closing is None:
+            self._build()
+        return self._commas.get(i, [])
+
+
+def replace_name(
+    i: int, tokens: list[Token], brackets: Brackets, *, name: str, new: str
+) -> Iterator[Edit]:
     # Borrowed from
     # https://github.com/asottile/pyupgrade/blob/main/pyupgrade/_token_helpers.py#L461
-    new_token = tokens[i]._replace(name="CODE", src=new)
     j = i
     while tokens[j].src != name:
         # timid: if we see a parenthesis here, skip it
         if tokens[j].src == ")":
             return
         j += 1
-    tokens[i : j + 1] = [new_token]
+    yield Edit(i, j + 1, new)
 
 
-def replace_string(i: int, tokens: list[Token], *, new: str) -> None:
-    new_token = tokens[i]._replace(name="CODE", src=new)
-    tokens[i] = new_token
+def replace_string(
+    i: int, tokens: list[Token], brackets: Brackets, *, new: str
+) -> Iterator[Edit]:
+    yield Edit(i, i + 1, new)
 
 
-def remove_name_from_import(i: int, tokens: list[Token], *, name: str) -> None:
+def _remove_name_from_import(tokens: list[Token], name: str) -> None:
+    i = 0
     while tokens[i].src != name:
         i += 1
         if tokens[i].name == "NEWLINE":
@@ -63,15 +158,30 @@ def remove_name_from_import(i: int, tokens: list[Token], *, name: str) -> None:
             del tokens[last_comma]
 
 
-def remove_statement(i: int, tokens: list[Token]) -> None:
+def remove_names_from_import(
+    i: int, tokens: list[Token], brackets: Brackets, *, names: list[str]
+) -> Iterator[Edit]:
+    j = i
+    while j < len(tokens) and tokens[j].name != "NEWLINE":
+        j += 1
+    # Removing a name affects how the following one is removed, so work on
+    # a copy of the statement and replace it as a whole.
+    statement = tokens[i : j + 1]
+    for name in reversed(names):
+        _remove_name_from_import(statement, name)
+    yield Edit(i, j + 1, "".join(token.src for token in statement))
+
+
+def remove_statement(i: int, tokens: list[Token], brackets: Brackets) -> Iterator[Edit]:
     j = i
     while j < len(tokens) and tokens[j].name != "NEWLINE":
         j += 1
-    tokens[i : j + 1] = []
+    yield Edit(i, j + 1, "")
 
 
-def ast_to_offset(ast: AST) -> Offset:
-    return Offset(ast.lineno, ast.col_offset)
+def ast_to_offset(ast: AST) -> tuple[int, int]:
+    # Equal to the tokens' Offset with the same values, which is a NamedTuple
+    return (ast.lineno, ast.col_offset)
 
 
 def find_token(tokens: list[Token], start: int, src: str) -> int:
@@ -79,16 +189,3 @@ def find_token(tokens: list[Token], start: int, src: str) -> int:
     while tokens[i].src != src:
         i += 1
     return i
-
-
-def find_closing_bracket(tokens: list[Token], start: int) -> int:
-    assert tokens[start].src == "[", tokens[start]
-    i = start + 1
-    depth = 1
-    while depth:
-        if tokens[i].src == "[":
-            depth += 1
-        elif tokens[i].src == "]":
-            depth -= 1
-        i += 1
-    return i - 1
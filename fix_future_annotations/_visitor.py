@@ -1,41 +1,45 @@
 from __future__ import annotations
 
 import ast
-import contextlib
 import sys
-from functools import partial
-from typing import Any, Callable, List, NamedTuple
+from collections import Counter
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List, NamedTuple
 
-from tokenize_rt import NON_CODING_TOKENS, Offset, Token
 
 from fix_future_annotations._config import Config
 from fix_future_annotations._utils import (
+    Brackets,
+    Edit,
     ast_to_offset,
-    find_closing_bracket,
     find_token,
-    remove_name_from_import,
+    remove_names_from_import,
     remove_statement,
     replace_name,
     replace_string,
 )
 
+if TYPE_CHECKING:
+    from tokenize_rt import Token
+
 BASIC_COLLECTION_TYPES = frozenset(
     {"Set", "List", "Tuple", "Dict", "FrozenSet", "Type"}
 )
+LOWER_COLLECTION_TYPES = frozenset(name.lower() for name in BASIC_COLLECTION_TYPES)
 IMPORTS_TO_REMOVE = BASIC_COLLECTION_TYPES | frozenset({"Optional", "Union"})
-TokenFunc = Callable[[int, List[Token]], None]
+TokenFunc = Callable[[int, List["Token"], Brackets], Iterable[Edit]]
 
 
-def _fix_optional(i: int, tokens: list[Token]) -> None:
+def _fix_optional(i: int, tokens: list[Token], brackets: Brackets) -> Iterator[Edit]:
     j = find_token(tokens, i, "[")
-    k = find_closing_bracket(tokens, j)
+    k = brackets.closing(j)
     if tokens[j].line == tokens[k].line:
-        tokens[k] = Token("CODE", " | None")
-        del tokens[i : j + 1]
+        yield Edit(k, k + 1, " | None")
+        yield Edit(i, j + 1, "")
     else:
-        tokens[j] = tokens[j]._replace(src="(")
-        tokens[k] = tokens[k]._replace(src=")")
-        tokens[i:j] = [Token("CODE", "None | ")]
+        yield Edit(j, j + 1, "(")
+        yield Edit(k, k + 1, ")")
+        yield Edit(i, j, "None | ")
 
 
 def _get_arg_count(node_slice: ast.expr) -> int:
@@ -54,136 +58,227 @@ def _get_arg_count(node_slice: ast.expr) -> int:
         return 1
 
 
-def _fix_union(i: int, tokens: list[Token], *, arg_count: int) -> None:
-    depth = 1
-    parens_done = []
-    open_parens = []
-    commas = []
-    coding_depth = None
+def _fix_union(
+    i: int, tokens: list[Token], brackets: Brackets, *, arg_count: int
+) -> Iterator[Edit]:
+    from tokenize_rt import NON_CODING_TOKENS
 
     j = find_token(tokens, i, "[")
-    k = j + 1
-    while depth:
-        # it's possible our first coding token is a close paren
-        # so make sure this is separate from the if chain below
-        if (
-            tokens[k].name not in NON_CODING_TOKENS
-            and tokens[k].src != "("
-            and coding_depth is None
-        ):
-            if tokens[k].src == ")":  # the coding token was an empty tuple
-                coding_depth = depth - 1
-            else:
-                coding_depth = depth
-
-        if tokens[k].src in "([{":
-            if tokens[k].src == "(":
-                open_parens.append((depth, k))
-
-            depth += 1
-        elif tokens[k].src in ")]}":
-            if tokens[k].src == ")":
-                paren_depth, open_paren = open_parens.pop()
-                parens_done.append((paren_depth, (open_paren, k)))
-
-            depth -= 1
-        elif tokens[k].src == ",":
-            commas.append((depth, k))
-
-        k += 1
-    k -= 1
-
-    assert coding_depth is not None
-    assert not open_parens, open_parens
-    comma_depth = min((depth for depth, _ in commas), default=sys.maxsize)
-    min_depth = min(comma_depth, coding_depth)
-
-    to_delete = [
-        paren
-        for depth, positions in parens_done
-        if depth < min_depth
-        for paren in positions
-    ]
-
-    if comma_depth <= coding_depth:
-        comma_positions = [k for depth, k in commas if depth == comma_depth]
-        if len(comma_positions) == arg_count:
-            to_delete.append(comma_positions.pop())
-    else:
-        comma_positions = []
-
-    to_delete.sort()
+    k = brackets.closing(j)
+
+    # The depth of the first coding token, below the parentheses wrapping the
+    # whole subscript if any
+    coding_depth = 1
+    m = j + 1
+    while tokens[m].name in NON_CODING_TOKENS or tokens[m].src == "(":
+        if tokens[m].src == "(":
+            coding_depth += 1
+        m += 1
+    if tokens[m].src == ")":  # the coding token was an empty tuple
+        coding_depth -= 1
+
+    # Go down the brackets level by level: the commas at the lowest depth
+    # separate the members, unless they are below the coding depth, and the
+    # parentheses above them are redundant.
+    to_delete = []
+    comma_positions: list[int] = []
+    level = [j]
+    for depth in range(1, coding_depth + 1):
+        comma_positions = [comma for b in level for comma in brackets.commas(b)]
+        if comma_positions or depth == coding_depth:
+            break
+        level = [child for b in level for child in brackets.children(b)]
+        for child in level:
+            if tokens[child].src == "(":
+                to_delete += (child, brackets.closing(child))
+
+    if len(comma_positions) == arg_count:
+        to_delete.append(comma_positions.pop())
 
     if tokens[j].line == tokens[k].line:
-        del tokens[k]
-        for comma in comma_positions:
-            tokens[comma] = Token("CODE", " |")
-        for paren in reversed(to_delete):
-            del tokens[paren]
-        del tokens[i : j + 1]
+        yield Edit(k, k + 1, "")
+        yield Edit(i, j + 1, "")
     else:
-        tokens[j] = tokens[j]._replace(src="(")
-        tokens[k] = tokens[k]._replace(src=")")
-
-        for comma in comma_positions:
-            tokens[comma] = Token("CODE", " |")
-        for paren in reversed(to_delete):
-            del tokens[paren]
-        del tokens[i:j]
-
-
-class State(NamedTuple):
-    in_annotation: bool
-    in_literal: bool
-    omit: bool
-
-    def update_annotation(self) -> bool:
-        return self.in_annotation and not self.omit
-
-
-class AnnotationVisitor(ast.NodeVisitor):
-    def __init__(self, lines: list[str], *, config: Config) -> None:
-        super().__init__()
+        yield Edit(j, j + 1, "(")
+        yield Edit(k, k + 1, ")")
+        yield Edit(i, j, "")
+    for comma in comma_positions:
+        yield Edit(comma, comma + 1, " |")
+    for paren in to_delete:
+        yield Edit(paren, paren + 1, "")
+
+
+# The traversal state is a combination of these flags
+IN_ANNOTATION = 1
+IN_LITERAL = 2
+OMIT = 4
+
+# The kinds of rewrites
+COLLECTION = "collection"  # typing.List[int] -> list[int]
+OPTIONAL = "optional"  # Optional[int] -> int | None
+UNION = "union"  # Union[int, str] -> int | str
+STRING = "string"  # "Foo" -> Foo
+IMPORT = "import"  # remove the unused typing imports
+
+ANNOTATION_FIELDS = frozenset({"annotation", "returns"})
+
+
+class ImportState(NamedTuple):
+    """What the imports seen so far tell the visitor, which is all that the
+    visit of a statement depends on besides the statement itself.
+    """
+
+    typing_import_name: str | None
+    typing_extensions_import_name: str | None
+    literal_import_name: str | None
+    typing_imports_to_remove: frozenset[tuple[str, str]]
+    has_future_annotations: bool
+
+
+@lru_cache(maxsize=None)
+def _get_handlers(cls: type) -> dict[type, Callable[[Any, Any], int | None]]:
+    return {
+        getattr(ast, name[len("visit_") :]): getattr(cls, name)
+        for name in dir(cls)
+        if name.startswith("visit_") and hasattr(ast, name[len("visit_") :])
+    }
+
+
+class AnnotationVisitor:
+    """Walk the AST to find what needs to be fixed.
+
+    The tree is traversed with an explicit stack. A ``visit_<NodeType>``
+    method is called with ``self.state`` set to the state of the node and
+    returns the state to visit the children with, or None to skip them.
+    """
+
+    def __init__(
+        self,
+        lines: list[str],
+        *,
+        config: Config,
+        excluded_lines: set[int] | None = None,
+    ) -> None:
         self.lines = lines
         self.config = config
-        self.token_funcs: dict[Offset, list[TokenFunc]] = {}
+        if excluded_lines is None:
+            excluded_lines = config.get_excluded_lines(lines)
+        self._excluded_lines = excluded_lines
+        self.token_funcs: dict[tuple[int, int], list[TokenFunc]] = {}
+        self.edit_counts: Counter[str] = Counter()
+        self.state = 0
 
         self._typing_import_name: str | None = None
         self._typing_extensions_import_name: str | None = None
         self._has_future_annotations = False
         self._using_new_annotations = False
-        self._state_stack: list[State] = []
         self._typing_imports_to_remove: dict[str, str] = {}
         self._literal_import_name: str | None = None
-        self._conditional_callbacks: list[
-            tuple[Callable[[], bool], Callable[[], None]]
-        ] = []
-
-    def add_token_func(self, offset: Offset, func: TokenFunc) -> None:
-        self.token_funcs.setdefault(offset, []).append(func)
-
-    def add_conditional_token_func(
-        self, condition: Callable[[], bool], offset: Offset, func: TokenFunc
+        # The `from typing import ...` statements, and the names among
+        # _typing_imports_to_remove that are used outside of annotations
+        self._typing_import_nodes: list[ast.ImportFrom] = []
+        self._runtime_used_names: set[str] = set()
+        # The offset of the first place found to need a fix
+        self.first_fix_offset: tuple[int, int] | None = None
+        self._stop_at_first_fix = False
+
+    def add_token_func(
+        self, offset: tuple[int, int], func: TokenFunc, kind: str
     ) -> None:
-        self._conditional_callbacks.append(
-            (condition, partial(self.add_token_func, offset, func))
-        )
-
-    def _is_excluded(self, node: ast.AST) -> bool:
-        line = self.lines[node.lineno - 1]
-        return self.config.is_line_excluded(line)
+        self.token_funcs.setdefault(offset, []).append(func)
+        self.edit_counts[kind] += 1
+        if self.first_fix_offset is None:
+            self.first_fix_offset = offset
+
+    def _use_new_annotations(self, node: ast.AST) -> None:
+        self._using_new_annotations = True
+        if self.first_fix_offset is None and not self._has_future_annotations:
+            self.first_fix_offset = ast_to_offset(node)
+
+    def _remove_unused_typing_imports(self, node: ast.ImportFrom) -> None:
+        unused = [
+            alias.name
+            for alias in node.names
+            if (alias.asname or alias.name) in self._typing_imports_to_remove
+        ]
+        if len(unused) == len(node.names):
+            self.add_token_func(ast_to_offset(node), remove_statement, IMPORT)
+        elif unused:
+            self.add_token_func(
+                ast_to_offset(node),
+                partial(remove_names_from_import, names=unused),
+                IMPORT,
+            )
 
-    def get_token_functions(self, tree: ast.Module) -> dict[Offset, list[TokenFunc]]:
-        with self.under_state(State(False, False, False)):
-            self.visit(tree)
-        for condition, callback in self._conditional_callbacks:
-            if condition():
-                callback()
+    def get_token_functions(
+        self, tree: ast.Module
+    ) -> dict[tuple[int, int], list[TokenFunc]]:
+        self.visit(tree)
+        self.resolve_typing_imports()
         return self.token_funcs
 
-    @property
-    def state(self) -> State:
-        return self._state_stack[-1]
+    def find_first_fix(self, tree: ast.Module) -> tuple[int, int] | None:
+        """Return the offset of the first place to fix, or None if there is
+        none. The tree is only visited until one is found, and no token
+        function is meant to be run.
+        """
+        self._stop_at_first_fix = True
+        self.visit(tree)
+        if self.first_fix_offset is None:
+            self.resolve_typing_imports()
+        return self.first_fix_offset
+
+    def get_import_state(self) -> ImportState:
+        return ImportState(
+            self._typing_import_name,
+            self._typing_extensions_import_name,
+            self._literal_import_name,
+            frozenset(self._typing_imports_to_remove.items()),
+            self._has_future_annotations,
+        )
+
+    def set_import_state(self, state: ImportState) -> None:
+        self._typing_import_name = state.typing_import_name
+        self._typing_extensions_import_name = state.typing_extensions_import_name
+        self._literal_import_name = state.literal_import_name
+        self._typing_imports_to_remove = dict(state.typing_imports_to_remove)
+        self._has_future_annotations = state.has_future_annotations
+
+    def merge(self, other: AnnotationVisitor, line_delta: int = 0) -> None:
+        """Add what the other visitor found, with its line numbers moved by
+        line_delta, as if this visitor had visited the same statements.
+
+        The other visitor must have started from the import state of this one.
+        """
+        for (line, col), funcs in other.token_funcs.items():
+            self.token_funcs.setdefault((line + line_delta, col), []).extend(funcs)
+        self.edit_counts.update(other.edit_counts)
+        self._runtime_used_names.update(other._runtime_used_names)
+        for node in other._typing_import_nodes:
+            if line_delta:
+                node = ast.ImportFrom(
+                    module=node.module,
+                    names=node.names,
+                    level=node.level,
+                    lineno=node.lineno + line_delta,
+                    col_offset=node.col_offset,
+                )
+            self._typing_import_nodes.append(node)
+        self._using_new_annotations |= other._using_new_annotations
+        if self.first_fix_offset is None and other.first_fix_offset is not None:
+            line, col = other.first_fix_offset
+            self.first_fix_offset = (line + line_delta, col)
+        self.set_import_state(other.get_import_state())
+
+    def resolve_typing_imports(self) -> None:
+        """Decide what to remove now that all usages are known."""
+        for name in self._runtime_used_names:
+            self._typing_imports_to_remove.pop(name, None)
+        for node in self._typing_import_nodes:
+            self._remove_unused_typing_imports(node)
+
+    def _update_annotation(self) -> bool:
+        return self.state & (IN_ANNOTATION | OMIT) == IN_ANNOTATION
 
     @property
     def need_future_annotations(self) -> bool:
@@ -191,132 +286,128 @@ class AnnotationVisitor(ast.NodeVisitor):
             bool(self.token_funcs) or self._using_new_annotations
         )
 
-    @contextlib.contextmanager
-    def under_state(self, state: State) -> None:
-        self._state_stack.append(state)
-        try:
-            yield
-        finally:
-            self._state_stack.pop()
-
-    def visit(self, node: ast.AST) -> Any:
-        if isinstance(node, ast.stmt) and self._is_excluded(node):
-            ctx = self.under_state(self.state._replace(omit=True))
-        else:
-            ctx = contextlib.nullcontext()
-        with ctx:
-            return super().visit(node)
-
-    def generic_visit(self, node: ast.AST) -> Any:
-        for field in reversed(node._fields):
-            value = getattr(node, field)
-            if field in {"annotation", "returns"}:
-                ctx = self.under_state(self.state._replace(in_annotation=True))
-            else:
-                ctx = contextlib.nullcontext()
-            with ctx:
+    def visit(self, tree: ast.AST, state: int = 0) -> None:
+        handlers = _get_handlers(type(self))
+        excluded_lines = self._excluded_lines
+        stop_at_first_fix = self._stop_at_first_fix
+        nodes: list[ast.AST] = [tree]
+        states = [state]
+        while nodes:
+            if stop_at_first_fix and self.first_fix_offset is not None:
+                break
+            node = nodes.pop()
+            state = states.pop()
+            if (
+                excluded_lines
+                and isinstance(node, ast.stmt)
+                and node.lineno in excluded_lines
+            ):
+                state |= OMIT
+            handler = handlers.get(type(node))
+            if handler is not None:
+                self.state = state
+                state = handler(self, node)
+                if state is None:
+                    continue
+            # Push the children so that they are popped in the order of
+            # reversed fields, and in order within a field.
+            for field in node._fields:
+                value = getattr(node, field, None)
                 if isinstance(value, list):
-                    for item in value:
+                    child_state = (
+                        state | IN_ANNOTATION if field in ANNOTATION_FIELDS else state
+                    )
+                    for item in reversed(value):
                         if isinstance(item, ast.AST):
-                            self.visit(item)
+                            nodes.append(item)
+                            states.append(child_state)
                 elif isinstance(value, ast.AST):
-                    self.visit(value)
+                    nodes.append(value)
+                    states.append(
+                        state | IN_ANNOTATION if field in ANNOTATION_FIELDS else state
+                    )
 
-    def visit_Import(self, node: ast.Import) -> Any:
+    def visit_Import(self, node: ast.Import) -> int | None:
         for alias in node.names:
             if alias.name == "typing":
                 self._typing_import_name = alias.asname or alias.name
             elif alias.name == "typing_extensions":
                 self._typing_extensions_import_name = alias.asname or alias.name
-        return self.generic_visit(node)
+        return self.state
 
-    def visit_ImportFrom(self, node: ast.ImportFrom) -> Any:
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> int | None:
         if node.module == "__future__":
             if any(alias.name == "annotations" for alias in node.names):
                 self._has_future_annotations = True
         elif node.module == "typing":
-            names: set[str] = {(alias.asname or alias.name) for alias in node.names}
             for alias in reversed(node.names):
                 key = alias.asname or alias.name
                 if alias.name == "Literal":
                     self._literal_import_name = key
                 if alias.name in IMPORTS_TO_REMOVE:
                     self._typing_imports_to_remove[key] = alias.name
-                    self.add_conditional_token_func(
-                        lambda key=key: key in self._typing_imports_to_remove,
-                        ast_to_offset(alias if hasattr(alias, "lineno") else node),
-                        partial(remove_name_from_import, name=alias.name),
-                    )
-
-            self.add_conditional_token_func(
-                lambda names=names: names <= set(self._typing_imports_to_remove),
-                ast_to_offset(node),
-                remove_statement,
-            )
+            self._typing_import_nodes.append(node)
         elif node.module == "typing_extensions":
             alias = next((a for a in node.names if a.name == "Literal"), None)
             if alias is not None:
                 self._literal_import_name = alias.asname or alias.name
         else:
-            return self.generic_visit(node)
+            return self.state
 
-    def visit_Attribute(self, node: ast.Attribute) -> Any:
+    def visit_Attribute(self, node: ast.Attribute) -> int | None:
         """Transform typing.List -> list"""
         if (
-            self.state.update_annotation()
+            self._update_annotation()
             and isinstance(node.value, ast.Name)
             and node.value.id == self._typing_import_name
             and node.attr in BASIC_COLLECTION_TYPES
+            # replace_name() gives up on a parenthesized module, e.g. (typing).List
+            and ast_to_offset(node.value) == ast_to_offset(node)
         ):
             self.add_token_func(
                 ast_to_offset(node),
                 partial(replace_name, name=node.attr, new=node.attr.lower()),
+                COLLECTION,
             )
-        return self.generic_visit(node)
+        return self.state
 
-    def visit_Name(self, node: ast.Name) -> Any:
+    def visit_Name(self, node: ast.Name) -> int | None:
         if node.id in self._typing_imports_to_remove:
             name = self._typing_imports_to_remove[node.id]
-            if not self.state.update_annotation():
+            if not self._update_annotation():
                 # It is referred to outside of an annotation, so we need to exclude it
-                self._conditional_callbacks.insert(
-                    0,
-                    (
-                        lambda: True,
-                        lambda key=node.id: self._typing_imports_to_remove.pop(
-                            key, None
-                        ),
-                    ),
-                )
+                self._runtime_used_names.add(node.id)
             elif name in BASIC_COLLECTION_TYPES:
                 self.add_token_func(
                     ast_to_offset(node),
                     partial(replace_name, name=node.id, new=name.lower()),
+                    COLLECTION,
                 )
 
-        return self.generic_visit(node)
+        return self.state
 
-    def visit_BinOp(self, node: ast.BinOp) -> Any:
-        if self.state.in_annotation:
-            self._using_new_annotations = True
-        return self.generic_visit(node)
+    def visit_BinOp(self, node: ast.BinOp) -> int | None:
+        if self.state & IN_ANNOTATION:
+            self._use_new_annotations(node)
+        return self.state
 
-    def visit_Subscript(self, node: ast.Subscript) -> Any:
-        if not self.state.update_annotation():
-            return self.generic_visit(node)
+    def visit_Subscript(self, node: ast.Subscript) -> int | None:
+        if not self._update_annotation():
+            return self.state
         if isinstance(node.value, ast.Attribute):
             if (
                 isinstance(node.value.value, ast.Name)
                 and node.value.value.id == self._typing_import_name
             ):
                 if node.value.attr == "Optional":
-                    self.add_token_func(ast_to_offset(node), _fix_optional)
+                    self.add_token_func(ast_to_offset(node), _fix_optional, OPTIONAL)
                 elif node.value.attr == "Union":
                     arg_count = _get_arg_count(node.slice)
                     if arg_count > 0:
                         self.add_token_func(
                             ast_to_offset(node),
                             partial(_fix_union, arg_count=arg_count),
+                            UNION,
                         )
             elif (
                 isinstance(node.value.value, ast.Name)
@@ -324,33 +415,32 @@ class AnnotationVisitor(ast.NodeVisitor):
                 in {self._typing_import_name, self._typing_extensions_import_name}
                 and node.value.attr == "Literal"
             ):
-                with self.under_state(self.state._replace(in_literal=True)):
-                    return self.generic_visit(node)
+                return self.state | IN_LITERAL
         elif isinstance(node.value, ast.Name):
             if node.value.id in self._typing_imports_to_remove:
                 if self._typing_imports_to_remove[node.value.id] == "Optional":
-                    self.add_token_func(ast_to_offset(node), _fix_optional)
+                    self.add_token_func(ast_to_offset(node), _fix_optional, OPTIONAL)
                 elif self._typing_imports_to_remove[node.value.id] == "Union":
                     arg_count = _get_arg_count(node.slice)
                     if arg_count > 0:
                         self.add_token_func(
                             ast_to_offset(node),
                             partial(_fix_union, arg_count=arg_count),
+                            UNION,
                         )
-            elif node.value.id in {name.lower() for name in BASIC_COLLECTION_TYPES}:
-                self._using_new_annotations = True
+            elif node.value.id in LOWER_COLLECTION_TYPES:
+                self._use_new_annotations(node)
             elif node.value.id == self._literal_import_name:
-                with self.under_state(self.state._replace(in_literal=True)):
-                    return self.generic_visit(node)
-        return self.generic_visit(node)
+                return self.state | IN_LITERAL
+        return self.state
 
-    def visit_Constant(self, node: ast.Constant) -> Any:
+    def visit_Constant(self, node: ast.Constant) -> int | None:
         if (
-            self.state.update_annotation()
-            and not self.state.in_literal
+            self._update_annotation()
+            and not self.state & IN_LITERAL
             and isinstance(node.value, str)
         ):
             self.add_token_func(
-                ast_to_offset(node), partial(replace_string, new=node.value)
+                ast_to_offset(node), partial(replace_string, new=node.value), STRING
             )
-        return self.generic_visit(node)
+        return self.state
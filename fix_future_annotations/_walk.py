@@ -0,0 +1,271 @@
+"""Find the Python files under a directory.
+
+The walk doesn't descend into the directories that can't contain files to
+fix: the well-known environment and build directories, the directories
+matched by ``exclude_files`` and the ones ignored by ``.gitignore`` or
+``.ignore`` files.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from fix_future_annotations._config import Config, ConfigResolver
+
+# Mostly the same as black's default excludes
+DEFAULT_SKIP_DIRS = frozenset(
+    {
+        ".direnv",
+        ".eggs",
+        ".fix_future_annotations_cache",
+        ".git",
+        ".hg",
+        ".ipynb_checkpoints",
+        ".mypy_cache",
+        ".nox",
+        ".pytest_cache",
+        ".ruff_cache",
+        ".svn",
+        ".tox",
+        ".venv",
+        ".vscode",
+        "__pycache__",
+        "__pypackages__",
+        "_build",
+        "buck-out",
+        "build",
+        "dist",
+        "node_modules",
+        "venv",
+    }
+)
+IGNORE_FILES = (".gitignore", ".ignore")
+
+
+def _translate(pattern: str) -> str:
+    """Translate a gitignore glob into a regex matching a relative path."""
+    result = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            at_boundary = i == 1 or pattern[i - 2] == "/"
+            if pattern.startswith("*/", i) and at_boundary:
+                # "**/" matches zero or more directories
+                result.append("(?:.*/)?")
+                i += 2
+            elif pattern.startswith("*", i) and at_boundary and i + 1 == n:
+                # A trailing "/**" matches everything inside
+                result.append(".*")
+                i += 1
+            else:
+                while pattern.startswith("*", i):
+                    i += 1
+                result.append("[^/]*")
+        elif c == "?":
+            result.append("[^/]")
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j < 0:
+                result.append(re.escape(c))
+            else:
+                chars = pattern[i:j].replace("\\", "\\\\").replace("[", "\\[")
+                if chars[:1] in ("!", "^"):
+                    chars = "^" + chars[1:]
+                result.append(f"[{chars}]")
+                i = j + 1
+        elif c == "\\" and i < n:
+            result.append(re.escape(pattern[i]))
+            i += 1
+        else:
+            result.append(re.escape(c))
+    return "".join(result)
+
+
+class IgnoreRules:
+    """The rules of the ignore files in one directory."""
+
+    def __init__(self, lines: list[str]) -> None:
+        # (pattern, negated, only matching directories, matching the name
+        # only), in reverse order since the last matching rule wins.
+        self.rules: List[Tuple[re.Pattern[str], bool, bool, bool]] = []
+        for line in lines:
+            line = line.rstrip("\r\n")
+            # Trailing spaces are ignored unless escaped
+            stripped = line.rstrip(" ")
+            if stripped.endswith("\\") and len(stripped) < len(line):
+                stripped += " "
+            line = stripped
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # Without a slash, the pattern matches the name at any level
+            # below the directory.
+            name_only = "/" not in line
+            pattern = re.compile(_translate(line.lstrip("/")), re.DOTALL)
+            self.rules.append((pattern, negated, dir_only, name_only))
+        self.rules.reverse()
+        # Most paths match no rule, tell those apart with a couple of regexes.
+        self._patterns = {
+            (is_dir, name_only): _combine(
+                rule[0]
+                for rule in self.rules
+                if rule[3] is name_only and (is_dir or not rule[2])
+            )
+            for is_dir in (False, True)
+            for name_only in (False, True)
+        }
+
+    @classmethod
+    def from_dir(cls, path: str, names: list[str]) -> IgnoreRules | None:
+        """Load the rules from the ignore files among the names in the
+        directory, or return None if there is none.
+        """
+        lines: list[str] = []
+        for name in IGNORE_FILES:
+            if name in names:
+                try:
+                    with open(
+                        os.path.join(path, name), encoding="utf-8", errors="replace"
+                    ) as f:
+                        lines.extend(f)
+                except OSError:
+                    continue
+        rules = cls(lines)
+        return rules if rules.rules else None
+
+    def match(self, prefix: str, name: str, is_dir: bool) -> bool | None:
+        """Return whether the path, relative to the directory of the ignore
+        files, is ignored, or None if no rule applies to it.
+        """
+        name_pattern = self._patterns[is_dir, True]
+        path_pattern = self._patterns[is_dir, False]
+        if not (name_pattern and name_pattern.fullmatch(name)) and not (
+            path_pattern and path_pattern.fullmatch(prefix + name)
+        ):
+            return None
+        for pattern, negated, dir_only, name_only in self.rules:
+            if (is_dir or not dir_only) and pattern.fullmatch(
+                name if name_only else prefix + name
+            ):
+                return not negated
+        return None
+
+
+def _combine(patterns: Iterable[re.Pattern[str]]) -> re.Pattern[str] | None:
+    regex = "|".join(f"(?:{p.pattern})" for p in patterns)
+    return re.compile(regex, re.DOTALL) if regex else None
+
+
+# The rules that apply in a directory, each with the relative path of the
+# directory to the one of the rules, ending with a "/" unless empty.
+IgnoreChain = Tuple[Tuple[IgnoreRules, str], ...]
+
+
+def _is_ignored(chain: IgnoreChain, name: str, is_dir: bool) -> bool:
+    # The rules of the deeper directories take precedence
+    for rules, prefix in reversed(chain):
+        ignored = rules.match(prefix, name, is_dir)
+        if ignored is not None:
+            return ignored
+    return False
+
+
+def _parent_ignore_rules(path: str) -> IgnoreChain:
+    """Return the rules of the ignore files in the parent directories of the
+    absolute path, up to the root of the git repository if the path is inside
+    one.
+    """
+    chain: list[tuple[IgnoreRules, str]] = []
+    child, parent = path, os.path.dirname(path)
+    while parent != child:
+        try:
+            names = os.listdir(parent)
+        except OSError:
+            break
+        rules = IgnoreRules.from_dir(parent, names)
+        if rules is not None:
+            prefix = os.path.relpath(path, parent).replace(os.sep, "/") + "/"
+            chain.append((rules, prefix))
+        if ".git" in names:
+            chain.reverse()
+            return tuple(chain)
+        child, parent = parent, os.path.dirname(parent)
+    # Not in a git repository, the ignore files of the parents don't apply
+    return ()
+
+
+def _is_dir_excluded(path: str, config: Config | ConfigResolver) -> bool:
+    if isinstance(config, ConfigResolver):
+        config = config.for_dir(path)
+    return config.is_dir_excluded(path)
+
+
+def walk_python_files(
+    top: str,
+    *,
+    config: Config | ConfigResolver,
+    ignore: bool = True,
+    on_dir: Callable[[str], None] | None = None,
+) -> Iterator[str]:
+    """Yield the paths of the Python files under the directory that are not
+    excluded, in the same order as ``os.walk()`` would find them.
+
+    With ``ignore`` set to False, the default skipped directories and the
+    ignore files are not taken into account. ``on_dir`` is called with the
+    path of each directory walked, before it is listed.
+    """
+    chain = _parent_ignore_rules(os.path.abspath(top)) if ignore else ()
+    stack: list[tuple[str, IgnoreChain]] = [(top, chain)]
+    while stack:
+        root, chain = stack.pop()
+        if on_dir is not None:
+            on_dir(root)
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        if ignore:
+            rules = IgnoreRules.from_dir(root, [entry.name for entry in entries])
+            if rules is not None:
+                chain = (*chain, (rules, ""))
+        subdirs: list[tuple[str, IgnoreChain]] = []
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Like os.walk(), don't follow the symlinks to directories
+                if (ignore and name in DEFAULT_SKIP_DIRS) or entry.is_symlink():
+                    continue
+                path = os.path.join(root, name)
+                if (chain and _is_ignored(chain, name, True)) or _is_dir_excluded(
+                    path.replace("\\", "/"), config
+                ):
+                    continue
+                subchain = tuple((r, f"{prefix}{name}/") for r, prefix in chain)
+                subdirs.append((path, subchain))
+            elif name.endswith(".py"):
+                if chain and _is_ignored(chain, name, False):
+                    continue
+                path = os.path.join(root, name).replace("\\", "/")
+                if not config.is_file_excluded(path):
+                    yield path
+        stack.extend(reversed(subdirs))
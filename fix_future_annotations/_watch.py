@@ -0,0 +1,168 @@
+"""Fix the files again as they change, for ``--watch``.
+
+After a first run on all the files, the watcher keeps the modification time
+and size of the files found, and the modification time of the directories
+walked. It polls them with os.stat(), which works anywhere without a file
+system notification service:
+- a file whose stat changed is fixed again
+- a directory whose modification time changed had entries added or removed,
+  and is walked again to find the new files
+Editors often save a file in several steps, so the changed files are only
+fixed once a poll finds no more changes. When a pyproject.toml looked at
+changes, the configuration is reloaded and all the files are fixed again.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from typing import Tuple
+
+from fix_future_annotations._config import ConfigResolver
+from fix_future_annotations._main import _run
+from fix_future_annotations._walk import walk_python_files
+
+# In seconds
+POLL_INTERVAL = 0.5
+DEBOUNCE = 0.2
+
+Stamp = Tuple[int, int]
+
+
+def _stat(path: str) -> Stamp | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class Watcher:
+    """Watch the paths given on the command line."""
+
+    def __init__(
+        self,
+        args: argparse.Namespace,
+        *,
+        interval: float = POLL_INTERVAL,
+        debounce: float = DEBOUNCE,
+    ) -> None:
+        self.args = args
+        self.interval = interval
+        self.debounce = debounce
+        self.resolver = ConfigResolver(args.config)
+        # The stamps of the files to fix and of the directories walked
+        self.files: dict[str, Stamp] = {}
+        self.dirs: dict[str, Stamp | None] = {}
+
+    def _add_dir(self, path: str) -> None:
+        self.dirs[path] = _stat(path)
+
+    def _walk(self, top: str) -> set[str]:
+        """Walk the directory and return the files that are new or changed."""
+        found = set()
+        for path in walk_python_files(
+            top, config=self.resolver, ignore=self.args.ignore, on_dir=self._add_dir
+        ):
+            stamp = _stat(path)
+            if stamp is not None and self.files.get(path) != stamp:
+                self.files[path] = stamp
+                found.add(path)
+        return found
+
+    def _add_files(self) -> set[str]:
+        # The files given on the command line, which may not exist yet
+        found = set()
+        for path in self.args.path:
+            if path in self.files or not path.endswith(".py"):
+                continue
+            stamp = _stat(path)
+            if stamp is not None and not os.path.isdir(path):
+                if not self.resolver.for_path(path).is_file_excluded(path):
+                    self.files[path] = stamp
+                    found.add(path)
+        return found
+
+    def index(self) -> None:
+        """Record the stamps of all the files and directories."""
+        self.files.clear()
+        self.dirs.clear()
+        for path in self.args.path:
+            if os.path.isdir(path):
+                self._walk(path)
+        self._add_files()
+
+    def poll(self) -> set[str]:
+        """Return the files that are new or changed since the last poll."""
+        changed = set()
+        dirs = []
+        for path, stamp in list(self.dirs.items()):
+            new = _stat(path)
+            if new is None:
+                del self.dirs[path]
+            elif new != stamp:
+                dirs.append(path)
+        # Walking a directory walks the ones below it too
+        dirs.sort()
+        for i, path in enumerate(dirs):
+            if i and path.startswith(os.path.join(dirs[i - 1], "")):
+                dirs[i] = dirs[i - 1]
+                continue
+            changed |= self._walk(path)
+        for path, stamp in list(self.files.items()):
+            new = _stat(path)
+            if new is None:
+                del self.files[path]
+            elif new != stamp:
+                self.files[path] = new
+                changed.add(path)
+        return changed | self._add_files()
+
+    def fix(self, paths: set[str]) -> int:
+        """Fix the files like the command line does, and return the exit code."""
+        paths = {path for path in paths if path in self.files}
+        if not paths:
+            return 0
+        args = argparse.Namespace(**{**vars(self.args), "path": sorted(paths)})
+        code = _run(args, self.resolver)
+        # Don't take the fixes for changes
+        for path in paths:
+            stamp = _stat(path)
+            if stamp is not None:
+                self.files[path] = stamp
+        return code
+
+    def run(self) -> int:
+        """Fix all the files, then the changed ones until interrupted."""
+        code = _run(self.args, self.resolver)
+        self.index()
+        print(
+            f"Watching {len(self.files)} files for changes, press Ctrl+C to stop",
+            file=sys.stderr,
+        )
+        try:
+            while True:
+                time.sleep(self.interval)
+                if self.resolver.is_stale():
+                    print(
+                        "The configuration changed, fixing all the files",
+                        file=sys.stderr,
+                    )
+                    self.resolver = ConfigResolver(self.args.config)
+                    code = _run(self.args, self.resolver)
+                    self.index()
+                    continue
+                changed = self.poll()
+                if not changed:
+                    continue
+                while True:
+                    time.sleep(self.debounce)
+                    more = self.poll()
+                    if not more:
+                        break
+                    changed |= more
+                code = self.fix(changed)
+        except KeyboardInterrupt:
+            return code
@@ -1,9 +1,38 @@
+import difflib
+import io
+import json
+import os
+import re
 from pathlib import Path
 import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import pytest
+from tokenize_rt import src_to_tokens
 
-from fix_future_annotations._main import fix_file
-from fix_future_annotations._config import Config
+from fix_future_annotations import (
+    FixResult,
+    FixSession,
+    Stats,
+    check_source,
+    fix_source,
+    fix_sources,
+)
+from fix_future_annotations._main import _parse_args, fix_file, main
+from fix_future_annotations._cache import Cache
+from fix_future_annotations._config import Config, ConfigResolver
+from fix_future_annotations._client import connect, get_socket_path
+from fix_future_annotations._daemon import serve_forever
+from fix_future_annotations._diff import get_opcodes, unified_diff
+from fix_future_annotations._prescan import might_need_fix
+from fix_future_annotations._shard import select_shard
+from fix_future_annotations._utils import Edit, EditConflictError, apply_edits
+from fix_future_annotations._walk import walk_python_files
+from fix_future_annotations._watch import Watcher
 
 SAMPLES = Path(__file__).with_name("samples")
 
@@ -27,3 +56,905 @@ def test_fix_samples(origin: Path, fixed: Path, tmp_path: Path) -> None:
 
     result = fix_file(copied, write=False, config=config)
     assert not result
+
+
+def _run_main(argv: list, capsys) -> tuple:
+    with pytest.raises(SystemExit) as exc_info:
+        main(argv)
+    return exc_info.value.code, capsys.readouterr().out
+
+
+def test_parallel_jobs_match_serial(tmp_path: Path, capsys) -> None:
+    for origin, _ in (param.values for param in _load_samples()):
+        shutil.copy2(origin, tmp_path)
+    serial = _run_main(["--check", "--no-cache", str(tmp_path)], capsys)
+    parallel = _run_main(["--check", "--no-cache", "-j", "2", str(tmp_path)], capsys)
+
+    assert serial[0] == 1
+    assert serial == parallel
+
+
+def test_cache_records_clean_files(tmp_path: Path) -> None:
+    config = Config()
+    cache = Cache(config, tmp_path / "cache")
+    clean = Path(shutil.copy2(SAMPLES / "from_import_fix.py", tmp_path))
+    dirty = Path(shutil.copy2(SAMPLES / "from_import.py", tmp_path))
+
+    assert not fix_file(clean, config=config, cache=cache)
+    assert fix_file(dirty, config=config, cache=cache)
+    assert cache.is_clean(clean.read_text())
+    assert not cache.is_clean(dirty.read_text())
+    # A different configuration must not reuse the entries
+    other = Cache(Config(exclude_lines=["# noqa"]), tmp_path / "cache")
+    assert not other.is_clean(clean.read_text())
+
+
+def test_read_only_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = Cache(Config(), tmp_path / "cache")
+    cache.mark_clean("x = 1\n")
+
+    def utime(path: str) -> None:
+        raise PermissionError(path)
+
+    monkeypatch.setattr("os.utime", utime)
+    assert cache.is_clean("x = 1\n")
+    assert not cache.is_clean("x = 2\n")
+
+
+def test_cache_prune(tmp_path: Path) -> None:
+    # One entry by bucket
+    cache = Cache(Config(), tmp_path / "cache", max_entries=256)
+    sources = [f"x = {i}\n" for i in range(1000)]
+    for i, source in enumerate(sources):
+        cache.mark_clean(source)
+        os.utime(cache._entry(source, None), ns=(i, i))
+    cache.prune()
+
+    buckets = [p for p in (tmp_path / "cache").iterdir() if p.is_dir()]
+    assert all(len(list(bucket.iterdir())) == 1 for bucket in buckets)
+    assert cache.is_clean(sources[-1])
+    assert sum(cache.is_clean(source) for source in sources) == len(buckets)
+
+
+def test_cache_prune_only_written_buckets(tmp_path: Path) -> None:
+    cache = Cache(Config(), tmp_path / "cache", max_entries=256)
+    cache.mark_clean("x = 1\n")
+    # A bucket over its share, e.g. left by a run with a higher limit
+    other = tmp_path / "cache" / "other"
+    other.mkdir()
+    for i in range(3):
+        (other / str(i)).touch()
+    cache.prune()
+    assert len(list(other.iterdir())) == 3
+
+
+@pytest.mark.parametrize("sample", sorted(SAMPLES.glob("*.py")), ids=lambda p: p.stem)
+def test_prescan_never_skips_files_to_fix(
+    sample: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    copied = shutil.copy2(sample, tmp_path)
+    config = Config(exclude_lines=["# ffa: ignore", "class NoFix:"])
+    monkeypatch.setattr(
+        "fix_future_annotations._main.might_need_fix", lambda source: True
+    )
+    needs_fix = fix_file(copied, config=config)
+
+    assert might_need_fix(sample.read_text()) or not needs_fix
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "def foo(a: int, b: str = 'a') -> None:\n    return 'b'\n",
+        "x = {'a': 1}\ny = x[1:'a']\n",
+        "class A:\n    x: int\n    y = 'a' | 'b'\n",
+    ],
+)
+def test_prescan_skips_clean_source(source: str) -> None:
+    assert not might_need_fix(source)
+
+
+def test_apply_edits() -> None:
+    tokens = src_to_tokens("x: List[int]\n")
+    assert apply_edits(tokens, [Edit(3, 4, "list")]) == "x: list[int]\n"
+    # Identical edits are applied once
+    assert apply_edits(tokens, [Edit(3, 4, "list")] * 2) == "x: list[int]\n"
+
+    with pytest.raises(EditConflictError):
+        apply_edits(tokens, [Edit(3, 5, "list["), Edit(4, 5, "(")])
+
+
+@pytest.mark.parametrize("origin, fixed", _load_samples())
+def test_unified_diff(origin: Path, fixed: Path) -> None:
+    a = origin.read_text().splitlines()
+    b = fixed.read_text().splitlines()
+    rebuilt = []
+    for tag, i1, i2, j1, j2 in get_opcodes(a, b):
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+        rebuilt.extend(b[j1:j2])
+    assert rebuilt == b
+
+    assert list(unified_diff(a, b, "old", "new")) == list(
+        difflib.unified_diff(a, b, "old", "new")
+    )
+
+
+def test_fix_deeply_nested_annotation(tmp_path: Path) -> None:
+    source = "def foo(x: " + " | ".join(["int"] * 900) + ") -> None:\n    pass\n"
+    path = tmp_path / "nested.py"
+    path.write_text(source)
+
+    assert fix_file(path, write=True, config=Config())
+    assert path.read_text() == "from __future__ import annotations\n\n" + source
+
+
+@pytest.mark.parametrize("depth, width", [(180, 10), (10, 5000), (100, 1000)])
+def test_fix_nested_unions_in_linear_time(
+    depth: int, width: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    annotation = "Union[" + ", ".join(f"T{i}" for i in range(width)) + "]"
+    expected = " | ".join(f"T{i}" for i in range(width))
+    for i in range(depth):
+        if i % 2:
+            annotation = f"Union[{annotation}, int]"
+            expected += " | int"
+        else:
+            annotation = f"Optional[{annotation}]"
+            expected += " | None"
+    source = f"from typing import Optional, Union\ndef foo(x: {annotation}): pass\n"
+
+    class CountingList(list):
+        accesses = 0
+
+        def __getitem__(self, index):
+            CountingList.accesses += 1
+            return super().__getitem__(index)
+
+    tokens = CountingList(src_to_tokens(source))
+    monkeypatch.setattr("tokenize_rt.src_to_tokens", lambda source: tokens)
+    result = fix_source(source)
+
+    assert result.source == (
+        f"from __future__ import annotations\n\ndef foo(x: {expected}): pass\n"
+    )
+    # Scanning the subscripts again at each level would be quadratic
+    assert CountingList.accesses < 2 * len(tokens)
+
+
+def test_fix_with_brackets_in_fstrings() -> None:
+    source = (
+        "from typing import Optional, Union\n"
+        'x = f"({x})" + f"{x})]}}" + f"[{x:{y}}"\n'
+        "def foo(a: Optional[int], b: Union[int, str]) -> None:\n"
+        '    return f"{a}, {b})"\n'
+    )
+    result = fix_source(source)
+
+    assert result.source == (
+        "from __future__ import annotations\n\n"
+        'x = f"({x})" + f"{x})]}}" + f"[{x:{y}}"\n'
+        "def foo(a: int | None, b: int | str) -> None:\n"
+        '    return f"{a}, {b})"\n'
+    )
+
+
+@pytest.mark.parametrize(
+    "patterns",
+    [
+        [],
+        ["# ffa: ignore", "class NoFix:"],
+        ["^def", "(?i)CLASS", "foo\\s+bar", r"\Aimport"],
+        [r"\)\s*->", "^$"],
+        # Patterns with groups are not combined, their groups would clash
+        [r"(\w+) = \1", r"(a)\1"],
+        ["(?P<n>foo)", "(?P<n>bar)$"],
+    ],
+)
+def test_get_excluded_lines(patterns: list) -> None:
+    config = Config(exclude_lines=patterns)
+    lines = ["import os", "def foo(", ") -> None:", "", "class Foo:  # ffa: ignore"]
+    lines += ["    foo", "    bar", "class NoFix:", "aa", "x = x"]
+    expected = {
+        lineno
+        for lineno, line in enumerate(lines, 1)
+        if any(re.search(pattern, line) for pattern in patterns)
+    }
+
+    assert config.get_excluded_lines(lines) == expected
+
+
+def test_exclude_files_with_groups() -> None:
+    config = Config(exclude_files=["(?P<name>build)/", "(?P<name>dist)/", r"(a)\1"])
+
+    assert config.is_file_excluded("pkg/dist/foo.py")
+    assert config.is_file_excluded("pkg/aa.py")
+    assert not config.is_file_excluded("pkg/a.py")
+
+
+def test_fix_source() -> None:
+    source = (
+        "from typing import List, Optional\n\n"
+        "def foo(a: Optional[int], b: 'Foo') -> List[int]:\n"
+        "    pass\n"
+    )
+    result = fix_source(source)
+
+    assert result == FixResult(
+        "from __future__ import annotations\n\n"
+        "def foo(a: int | None, b: Foo) -> list[int]:\n"
+        "    pass\n",
+        changed=True,
+        edits={"import": 1, "optional": 1, "string": 1, "collection": 1},
+        added_future_import=True,
+    )
+    assert fix_source(result.source) == FixResult(result.source, changed=False)
+
+
+def test_keep_typing_imports_used_at_runtime() -> None:
+    source = (
+        "from typing import Optional, List\n"
+        "from typing import Dict, Union as U\n\n"
+        "def foo(a: Optional[int], b: U[int, str]) -> List[Dict[str, int]]:\n"
+        "    pass\n\n"
+    ) + "".join(f"S{i} = U[int, List[{i}]]\n" for i in range(1000))
+    result = fix_source(source)
+
+    assert result.source.startswith(
+        "from __future__ import annotations\n\n"
+        "from typing import List\n"
+        "from typing import Union as U\n\n"
+        "def foo(a: int | None, b: int | str) -> list[dict[str, int]]:\n"
+    )
+    assert result.edits["import"] == 2
+
+
+def test_fix_sources_in_workers() -> None:
+    sources = [origin.read_text() for origin, _ in (p.values for p in _load_samples())]
+    config = Config(exclude_lines=["# ffa: ignore", "class NoFix:"])
+    expected = [fix_source(source, config=config) for source in sources]
+
+    assert list(fix_sources(sources, config=config)) == expected
+    assert list(fix_sources(sources, config=config, jobs=2)) == expected
+
+
+def test_fix_session() -> None:
+    config = Config(exclude_lines=["# ffa: ignore", "class NoFix:"])
+    session = FixSession(config=config)
+    for origin, _ in (p.values for p in _load_samples()):
+        source = origin.read_text()
+        assert session.fix(source) == fix_source(source, config=config)
+        lines = source.splitlines(keepends=True)
+        # Edit, add and remove lines at the start, the middle and the end
+        for i in (0, len(lines) // 2, len(lines)):
+            for new_lines in (
+                lines[:i] + ["x: Optional[int] = None\n"] + lines[i:],
+                lines[:i] + ["from typing import Optional\n"] + lines[i + 1 :],
+                lines[:i] + lines[i + 1 :],
+                lines[:i] + ["    y: List[int] = []\n"] + lines[i:],
+            ):
+                new_source = "".join(new_lines)
+                try:
+                    expected = fix_source(new_source, config=config)
+                except SyntaxError:
+                    with pytest.raises(SyntaxError):
+                        session.fix(new_source)
+                else:
+                    assert session.fix(new_source) == expected
+
+
+def test_fix_session_reuses_statements() -> None:
+    source = "from typing import List\n\n" + "".join(
+        f"def f{i}(a: List[int]) -> Optional[str]:\n    pass\n" for i in range(10)
+    )
+    session = FixSession()
+    session.fix(source)
+    visitors = [statement.visitor for statement in session._statements]
+
+    new_source = source.replace("def f5(a: List[int])", "def f5(a: List[str])")
+    assert session.fix(new_source) == fix_source(new_source)
+    new_visitors = [statement.visitor for statement in session._statements]
+    # Only the changed function is visited again
+    reused = [a is b for a, b in zip(visitors, new_visitors)]
+    assert reused == [True] * 6 + [False] + [True] * 4
+
+    # The imports changed, so the statements after them are visited again
+    new_source = new_source.replace("List\n", "List, Optional\n")
+    assert session.fix(new_source) == fix_source(new_source)
+    assert not any(
+        a is b for a, b in zip(new_visitors, (s.visitor for s in session._statements))
+    )
+
+
+def test_stats(tmp_path: Path, capsys) -> None:
+    clean = shutil.copy2(SAMPLES / "from_import_fix.py", tmp_path)
+    dirty = shutil.copy2(SAMPLES / "from_import.py", tmp_path)
+    dirty_source = Path(dirty).read_text()
+    stats = Stats(slowest=1)
+    fix_file(clean, write=True, config=Config(), stats=stats)
+    fix_file(dirty, write=True, config=Config(), stats=stats)
+    fix_source("x = 1\n", stats=stats)
+
+    assert stats.counts == {"files": 2, "sources": 3, "skipped": 1, "changed": 1}
+    assert {"read", "prescan", "parse", "visit", "tokenize", "edit"} <= set(
+        stats.phases
+    )
+    assert len(stats.slowest_files()) == 1
+
+    # The stats of the worker processes are merged
+    workers = Stats()
+    list(fix_sources([dirty_source] * 3, jobs=2, stats=workers))
+    assert workers.counts["changed"] == 3
+
+    Path(dirty).write_text(dirty_source)
+    profile = tmp_path / "out.prof"
+    with pytest.raises(SystemExit):
+        main(["--check", "--stats", "--profile", str(profile), str(dirty)])
+    assert "Slowest files:" in capsys.readouterr().err
+    assert profile.stat().st_size > 0
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_json_report(jobs: str, tmp_path: Path, capsys) -> None:
+    shutil.copy2(SAMPLES / "from_import.py", tmp_path / "a.py")
+    shutil.copy2(SAMPLES / "from_import_fix.py", tmp_path / "b.py")
+    argv = ["--check", "--no-cache", "-j", jobs, str(tmp_path)]
+
+    code, out = _run_main([*argv, "--format", "json"], capsys)
+    assert code == 1
+    report = json.loads(out)
+    assert report["summary"] == {
+        "checked": 2,
+        "changed": 1,
+        "write": False,
+        "stopped": False,
+    }
+    a, b = sorted(report["files"], key=lambda file: file["path"])
+    # Only checking, the edits are reported all the same
+    assert a["status"] == "needs_fix"
+    assert a["edits"] == {"collection": 2, "optional": 3, "union": 2, "import": 1}
+    assert a["added_future_import"]
+    assert b["status"] == "unchanged"
+    assert b["edits"] == {} and not b["added_future_import"]
+
+    _, out = _run_main([*argv, "--format", "jsonl"], capsys)
+    lines = [json.loads(line) for line in out.splitlines()]
+    assert lines[:-1] == [
+        {**file, "seconds": line["seconds"]}
+        for file, line in zip(report["files"], lines)
+    ]
+    assert lines[-1] == {"summary": report["summary"]}
+
+    _, out = _run_main([*argv[1:], "--format", "json"], capsys)
+    a, b = sorted(json.loads(out)["files"], key=lambda file: file["path"])
+    assert a["status"] == "fixed"
+    assert a["edits"] == {"collection": 2, "optional": 3, "union": 2, "import": 1}
+    assert a["added_future_import"]
+    assert b["status"] == "unchanged"
+
+
+@pytest.mark.parametrize(
+    "separator, jobs", [("\n", "1"), ("\r\n", "2"), ("\0", "1"), ("\0", "2")]
+)
+def test_files_from(
+    separator: str,
+    jobs: str,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys,
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("fix_future_annotations._main._READ_SIZE", 7)
+    names = [f"dirty {i}.py" for i in range(30)] + ["clean.py", "excluded.py"]
+    for name in names:
+        shutil.copy2(SAMPLES / "from_import.py", name)
+    shutil.copy2(SAMPLES / "from_import_fix.py", "clean.py")
+    Path("pyproject.toml").write_text(
+        '[tool.fix_future_annotations]\nexclude_files = ["excluded"]\n'
+    )
+    listing = separator.join(names + ["", "README.md"]) + separator
+    Path("files.txt").write_text(listing, newline="")
+
+    code, out = _run_main(
+        ["--check", "--no-cache", "-j", jobs, "--files-from", "files.txt"], capsys
+    )
+    assert code == 1
+    assert out.splitlines()[:-1] == [
+        f"File needs to be fixed: {name}:8:20" for name in names[:30]
+    ]
+    assert out.splitlines()[-1] == "All complete, 30 files need to be fixed"
+
+    monkeypatch.setattr("sys.stdin", io.TextIOWrapper(io.BytesIO(listing.encode())))
+    assert _run_main(["--files-from", "-", "--no-cache", "-j", jobs], capsys) == (
+        1,
+        "".join(f"Fixing file: {name}\n" for name in names[:30])
+        + "All complete, 30 files were fixed\n",
+    )
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_fail_fast(jobs: str, tmp_path: Path, capsys) -> None:
+    paths = [str(tmp_path / name) for name in ("a.py", "b.py", "c.py", "d.py")]
+    shutil.copy2(SAMPLES / "from_import_fix.py", paths[0])
+    for path in paths[1:]:
+        shutil.copy2(SAMPLES / "from_import.py", path)
+    code, out = _run_main(
+        ["--check", "--no-cache", "--fail-fast", "-j", jobs, *paths], capsys
+    )
+
+    assert code == 1
+    assert out == (
+        f"File needs to be fixed: {tmp_path / 'b.py'}:8:20\n"
+        "Stopped at the first file to fix\n"
+    )
+
+
+def test_check_source() -> None:
+    assert check_source("x: List[int]\n") is None
+    assert check_source("from typing import List\n\nx: List[int]\n") == (3, 4)
+    # The unused import is removed
+    assert check_source("from typing import List\n") == (1, 1)
+    assert check_source("x: list[int]\n") == (1, 4)
+    assert check_source("from __future__ import annotations\nx: list[int]\n") is None
+    assert check_source("\nx: int | None\n") == (2, 4)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "from __future__ import annotations\nimport typing\nx: (typing).List[int]\n",
+        "import typing\nx: (typing).List[int]\ny: typing.List[int]\n",
+    ],
+)
+def test_check_source_agrees_with_fix_source(source: str) -> None:
+    result = fix_source(source)
+    assert (check_source(source) is not None) == result.changed
+    assert check_source(result.source) is None
+
+
+@pytest.mark.parametrize("filename, expected_code", [(None, 1), ("tests/foo.py", 0)])
+def test_fix_stdin(
+    filename,
+    expected_code: int,
+    capsysbinary,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    source = (SAMPLES / "from_import.py").read_bytes()
+    monkeypatch.setattr("sys.stdin", io.TextIOWrapper(io.BytesIO(source)))
+    config_file = tmp_path / "pyproject.toml"
+    config_file.write_text(
+        '[tool.fix_future_annotations]\nexclude_files = ["tests/"]\n'
+    )
+    argv = ["-", "--config", str(config_file)]
+    if filename is not None:
+        argv += ["--stdin-filename", filename]
+    with pytest.raises(SystemExit) as exc_info:
+        main(argv)
+
+    assert exc_info.value.code == expected_code
+    expected = (
+        source if expected_code == 0 else (SAMPLES / "from_import_fix.py").read_bytes()
+    )
+    assert capsysbinary.readouterr().out == expected
+
+
+needs_daemon = pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"),
+    reason="the daemon needs Unix sockets",
+)
+
+
+def _wait_for_socket(path: Path, server: threading.Thread) -> None:
+    deadline = time.monotonic() + 10
+    while not path.exists():
+        assert server.is_alive(), "the daemon exited"
+        assert time.monotonic() < deadline, "the daemon didn't start"
+        time.sleep(0.01)
+
+
+@needs_daemon
+def test_daemon(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys) -> None:
+    monkeypatch.chdir(tmp_path)
+    # Not under tmp_path, whose path may be too long for a socket
+    runtime_dir = tempfile.mkdtemp()
+    monkeypatch.setenv("XDG_RUNTIME_DIR", runtime_dir)
+    shutil.copy2(SAMPLES / "from_import.py", tmp_path / "foo.py")
+    argv = ["--use-daemon", "--check", "foo.py"]
+    # No daemon running, the work is done in process
+    with pytest.raises(SystemExit) as exc_info:
+        main(argv)
+    assert exc_info.value.code == 1
+
+    server = threading.Thread(target=serve_forever, args=([],))
+    server.start()
+    try:
+        socket_path = Path(get_socket_path())
+        _wait_for_socket(socket_path, server)
+        capsys.readouterr()
+        with pytest.raises(SystemExit) as exc_info:
+            main(argv)
+        assert exc_info.value.code == 1
+        assert capsys.readouterr().out == "File needs to be fixed: foo.py:8:20\n"
+
+        # The configuration is reloaded when it changes
+        (tmp_path / "pyproject.toml").write_text(
+            '[tool.fix_future_annotations]\nexclude_files = ["foo"]\n'
+        )
+        main(argv)
+        assert capsys.readouterr().out == ""
+    finally:
+        with pytest.raises(SystemExit) as exc_info:
+            main(["daemon", "--stop"])
+        server.join()
+        shutil.rmtree(runtime_dir)
+    assert exc_info.value.code == 0
+    assert not socket_path.exists()
+
+
+@needs_daemon
+def test_daemon_socket_must_be_trusted(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Not under tmp_path, whose path may be too long for a socket
+    temp_dir = tempfile.mkdtemp()
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setenv("TMPDIR", temp_dir)
+    path = get_socket_path(temp_dir)
+    runtime_dir = os.path.join(temp_dir, f"ffa-{os.getuid()}")
+    assert os.path.dirname(path) == runtime_dir
+
+    # A socket that anybody could have put in place is not connected to
+    os.makedirs(runtime_dir, mode=0o700)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        server.listen()
+        client = connect(path)
+        assert client is not None
+        client.close()
+        os.chmod(runtime_dir, 0o777)
+        assert connect(path) is None
+    finally:
+        server.close()
+        shutil.rmtree(temp_dir)
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_changed_since(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys) -> None:
+    monkeypatch.chdir(tmp_path)
+    sample = (SAMPLES / "from_import.py").read_text()
+    for name in ("committed.py", "modified.py", "src/staged.py", "src/excluded.py"):
+        Path(name).parent.mkdir(exist_ok=True)
+        Path(name).write_text(sample)
+
+    def git(*args: str) -> None:
+        subprocess.run(
+            ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+            check=True,
+            capture_output=True,
+        )
+
+    git("init", "-q")
+    git("add", "committed.py", "modified.py")
+    git("commit", "-q", "-m", "initial")
+    Path("modified.py").write_text(sample + "\n")
+    git("add", "src/")
+    (tmp_path / "pyproject.toml").write_text(
+        '[tool.fix_future_annotations]\nexclude_files = ["excluded"]\n'
+    )
+
+    def check(*args: str) -> list[str]:
+        capsys.readouterr()
+        with pytest.raises(SystemExit):
+            main(["--check", *args])
+        lines = capsys.readouterr().out.splitlines()
+        return sorted(line for line in lines if line.startswith("File"))
+
+    assert check("--changed-since", "HEAD", ".") == [
+        "File needs to be fixed: modified.py:8:20",
+        "File needs to be fixed: src/staged.py:8:20",
+    ]
+    assert check("--changed-since", "HEAD", "src") == [
+        "File needs to be fixed: src/staged.py:8:20"
+    ]
+    assert check("--staged", ".") == ["File needs to be fixed: src/staged.py:8:20"]
+    # Absolute paths, or paths out of the current directory, match them too
+    assert check("--changed-since", "HEAD", str(tmp_path)) == [
+        "File needs to be fixed: modified.py:8:20",
+        "File needs to be fixed: src/staged.py:8:20",
+    ]
+    monkeypatch.chdir(tmp_path / "src")
+    assert check("--changed-since", "HEAD", "..") == [
+        "File needs to be fixed: ../modified.py:8:20",
+        "File needs to be fixed: staged.py:8:20",
+    ]
+    monkeypatch.chdir(tmp_path)
+
+    shutil.rmtree(".git")
+    with pytest.raises(SystemExit):
+        main(["--check", "--changed-since", "HEAD", "."])
+    out, err = capsys.readouterr()
+    assert out.count("File needs to be fixed") == 3
+    assert "checking all the files" in err
+
+
+def test_walk_python_files(tmp_path: Path) -> None:
+    files = [
+        "a.py",
+        "top_only.py",
+        "foo_pb2.py",
+        "keep_pb2.py",
+        "readme.txt",
+        ".venv/lib/site.py",
+        "generated/gen.py",
+        "pkg/b.py",
+        "pkg/top_only.py",
+        "pkg/local.py",
+        "pkg/docs/x/conf.py",
+        "vendor/lib.py",
+    ]
+    for name in files:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    (tmp_path / ".gitignore").write_text(
+        "# comment\ngenerated/\n*_pb2.py\n!keep_pb2.py\n/top_only.py\n"
+    )
+    (tmp_path / "pkg" / ".ignore").write_text("local.py\ndocs/**/conf.py\n")
+
+    def walk(**kwargs) -> list[str]:
+        return sorted(
+            os.path.relpath(path, tmp_path).replace(os.sep, "/")
+            for path in walk_python_files(str(tmp_path), **kwargs)
+        )
+
+    assert walk(config=Config()) == [
+        "a.py",
+        "keep_pb2.py",
+        "pkg/b.py",
+        "pkg/top_only.py",
+        "vendor/lib.py",
+    ]
+    assert walk(config=Config(exclude_files=["/vendor/", "b\\.py$"])) == [
+        "a.py",
+        "keep_pb2.py",
+        "pkg/top_only.py",
+    ]
+    assert walk(config=Config(), ignore=False) == sorted(
+        name for name in files if name.endswith(".py")
+    )
+    # A pattern looking past the directory doesn't exclude all of it
+    (tmp_path / "pkg" / "tests" / "fixtures").mkdir(parents=True)
+    (tmp_path / "pkg" / "tests" / "fixtures" / "c.py").touch()
+    (tmp_path / "pkg" / "tests" / "d.py").touch()
+    assert walk(config=Config(exclude_files=["tests/(?!fixtures/)"])) == [
+        "a.py",
+        "keep_pb2.py",
+        "pkg/b.py",
+        "pkg/tests/fixtures/c.py",
+        "pkg/top_only.py",
+        "vendor/lib.py",
+    ]
+
+
+@pytest.mark.parametrize("mode", ["path", "size"])
+def test_select_shard(mode: str, tmp_path: Path, capsys) -> None:
+    paths = []
+    for i in range(40):
+        path = tmp_path / f"m{i}.py"
+        path.write_text("x = 1\n" * (i * 7 % 23 + 1))
+        paths.append(str(path))
+
+    def shards(paths: list) -> list:
+        return [
+            list(select_shard(paths, index, 3, mode=mode, root=str(tmp_path)))
+            for index in range(3)
+        ]
+
+    parts = shards(paths)
+    assert sorted(sum(parts, [])) == sorted(paths)
+    assert all(part == [p for p in paths if p in part] for part in parts)
+    # The same whatever the order the files are found in
+    assert [sorted(part) for part in shards(paths[::-1])] == [
+        sorted(part) for part in parts
+    ]
+    if mode == "path":
+        # Adding a file doesn't move the others
+        new = shards(paths + [str(tmp_path / "new.py")])
+        assert [[p for p in part if p in paths] for part in new] == parts
+    else:
+        sizes = [sum(os.path.getsize(p) for p in part) for part in parts]
+        assert max(sizes) - min(sizes) <= max(os.path.getsize(p) for p in paths)
+
+    capsys.readouterr()
+    main(["--check", "--no-cache", "--shard", "2/3", "--shard-by", mode, *paths])
+    assert capsys.readouterr().out == (
+        "All complete, no file is changed in shard 2/3\n"
+    )
+
+
+def test_watch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys) -> None:
+    monkeypatch.chdir(tmp_path)
+    dirty = (SAMPLES / "from_import.py").read_text()
+    clean = (SAMPLES / "from_import_fix.py").read_text()
+    Path("pkg").mkdir()
+    Path("pkg/a.py").write_text(clean)
+    Path("pkg/b.py").write_text(clean)
+    watcher = Watcher(_parse_args(["pkg"]))
+    watcher.index()
+    assert watcher.poll() == set()
+
+    def touch_dir(path: str) -> None:
+        # The modification time may not change within a clock tick
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    Path("pkg/a.py").write_text(dirty)
+    Path("pkg/sub").mkdir()
+    touch_dir("pkg")
+    # The paths found by the walker are separated by "/" on any platform
+    assert watcher.poll() == {"pkg/a.py"}
+    Path("pkg/sub/c.py").write_text(dirty)
+    touch_dir("pkg/sub")
+    Path("pkg/b.py").unlink()
+    touch_dir("pkg")
+    changed = watcher.poll()
+    assert changed == {"pkg/sub/c.py"}
+    assert "pkg/b.py" not in watcher.files
+
+    capsys.readouterr()
+    assert watcher.fix(changed | {"pkg/a.py"}) == 1
+    # And printed as a Path, like all the reports
+    assert capsys.readouterr().out.splitlines() == [
+        f"Fixing file: {Path('pkg/a.py')}",
+        f"Fixing file: {Path('pkg/sub/c.py')}",
+        "All complete, 2 files were fixed",
+    ]
+    # The fixes are not taken for changes
+    assert watcher.poll() == set()
+
+    # A change of the configuration fixes all the files again
+    Path("pkg/a.py").write_text(dirty)
+    sleeps = iter([None, KeyboardInterrupt()])
+
+    def sleep(seconds: float) -> None:
+        Path("pyproject.toml").write_text(
+            '[tool.fix_future_annotations]\nexclude_files = ["sub"]\n'
+        )
+        error = next(sleeps)
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr("time.sleep", sleep)
+    assert Watcher(_parse_args(["--check", "pkg"])).run() == 1
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [
+        f"File needs to be fixed: {Path('pkg/a.py')}:8:20",
+        "All complete, 1 files need to be fixed",
+        # Without pkg/sub/c.py
+        f"File needs to be fixed: {Path('pkg/a.py')}:8:20",
+    ]
+    assert "The configuration changed" in err
+
+
+def test_config_resolver(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pyproject.toml").write_text(
+        '[tool.fix_future_annotations]\nexclude_lines = ["root"]\n'
+    )
+    # A pyproject.toml without the table doesn't stop the lookup
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "pyproject.toml").write_text("[tool.black]\n")
+    (tmp_path / "a" / "b" / "c").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "pyproject.toml").write_text(
+        '[tool.fix_future_annotations]\nexclude_lines = ["nested"]\n'
+    )
+
+    resolver = ConfigResolver()
+    root = resolver.for_path("foo.py")
+    assert root.exclude_lines == ["root"]
+    assert resolver.for_path("a/foo.py") is root
+    nested = resolver.for_path("a/b/c/foo.py")
+    assert nested.exclude_lines == ["nested"]
+    assert resolver.for_dir(tmp_path / "a" / "b") is nested
+    assert not resolver.is_stale()
+
+    (tmp_path / "a" / "b" / "c" / "pyproject.toml").write_text(
+        '[tool.fix_future_annotations]\nexclude_lines = ["deeper"]\n'
+    )
+    assert resolver.is_stale()
+    assert ConfigResolver().for_path("a/b/c/foo.py").exclude_lines == ["deeper"]
+    assert ConfigResolver("a/b/pyproject.toml").for_path("foo.py") == nested
+
+
+def test_broken_nested_config(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pyproject.toml").write_text(
+        '[tool.fix_future_annotations]\nexclude_files = ["excluded"]\n'
+    )
+    for name, content in [
+        ("bad", "[tool.black\n"),
+        ("unknown", "[tool.fix_future_annotations]\nexclude = []\n"),
+    ]:
+        (tmp_path / "tests" / name / "excluded").mkdir(parents=True)
+        (tmp_path / "tests" / name / "pyproject.toml").write_text(content)
+        (tmp_path / "tests" / name / "excluded" / "a.py").write_text(
+            "from typing import List\nx: List[int] = []\n"
+        )
+
+    for name in ("a.py", "b.py"):
+        (tmp_path / name).write_text("x = 1\n")
+
+    # The broken files are reported, and the parent configuration is used
+    main(["--check", "--no-cache", "."])
+    out, err = capsys.readouterr()
+    assert "All complete, no file is changed" in out
+    assert os.path.join("tests", "bad", "pyproject.toml") in err
+    assert "unknown keys in [tool.fix_future_annotations]: exclude" in err
+
+
+# Modules that a run on files needing no fix must not import
+LAZY_MODULES = {
+    "concurrent.futures",
+    "dataclasses",
+    "difflib",
+    "importlib.metadata",
+    "tokenize_rt",
+    "tomli",
+    "tomllib",
+}
+IMPORT_TIME_BUDGET_US = 75_000
+
+
+def test_imports_are_lazy(tmp_path: Path) -> None:
+    (tmp_path / "clean.py").write_text(
+        "from __future__ import annotations\n\n"
+        "def foo(x: int) -> list[int]:\n    return [x]\n"
+    )
+    # Checking a file that needs a fix doesn't need tokenize-rt either
+    shutil.copy2(SAMPLES / "from_import.py", tmp_path / "dirty.py")
+    code = """if True:
+        import json, sys
+        import fix_future_annotations
+        print(json.dumps(list(sys.modules)))
+        from fix_future_annotations._main import main
+        try:
+            main(["--check", "--no-cache", "clean.py", "dirty.py"])
+        except SystemExit:
+            pass
+        print(json.dumps(list(sys.modules)))
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    lines = [line for line in output.splitlines() if line.startswith("[")]
+    after_import, after_run = (set(json.loads(line)) for line in lines)
+    # The entry point only needs the package to talk to the daemon
+    assert not after_import & (
+        LAZY_MODULES | {"argparse", "fix_future_annotations._main"}
+    )
+    assert not after_run & LAZY_MODULES
+
+
+def test_import_time_budget() -> None:
+    def import_time() -> int:
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import fix_future_annotations"],
+            env={**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stderr
+        for line in stderr.splitlines():
+            _, cumulative, name = line.split("|")
+            if name.strip() == "fix_future_annotations":
+                return int(cumulative)
+        raise AssertionError(f"No import time reported:\n{stderr}")
+
+    # The best of a few runs, to rule out the noise of a busy machine
+    assert min(import_time() for _ in range(5)) < IMPORT_TIME_BUDGET_US